@@ -14,6 +14,7 @@
 
 
 # imports from python standard library
+import cPickle
 import grading
 import imp
 import optparse
@@ -80,6 +81,11 @@ def readCommand(argv):
                     dest = 'graphics',
                     action = 'store_true',
                     help = 'Display graphics for pacman games.')
+    parser.add_option('--jobs', '-j',
+                    dest = 'jobs',
+                    type = 'int',
+                    default = 1,
+                    help = 'Run test cases in this many worker processes.')
     (options, args) = parser.parse_args(argv)
     return options
 
@@ -244,9 +250,111 @@ def getTestSubdirs(testParser, testRoot, questionToGrade):
     return sorted(os.listdir(testRoot))
 
 
+# stands in for the grades of a test case run by a worker process
+class GradesRecorder(object):
+    """
+    Records the calls a test case makes on its grades, and what it prints in
+    between, so that they can be replayed on the real grading.Grades in the
+    main process.  It is installed as sys.stdout while the test case runs.
+    """
+    def __init__(self):
+        self.events = []
+        self.text = []
+
+    def write(self, text):
+        self.text.append(text)
+
+    def flush(self):
+        if len(self.text) > 0:
+            self.events.append(('print', ''.join(self.text)))
+            self.text = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        def record(*args, **kwargs):
+            self.flush()
+            self.events.append(('call', name, args, kwargs))
+        return record
+
+def replayGrades(events, grades):
+    for event in events:
+        if event[0] == 'print':
+            sys.stdout.write(event[1])
+        else:
+            getattr(grades, event[1])(*event[2], **event[3])
+
+# test case functions by (question, test), inherited by the worker processes
+TEST_CASE_FUNCTIONS = {}
+
+def runTestCaseFunction(key):
+    recorder = GradesRecorder()
+    stdout = sys.stdout
+    sys.stdout = recorder
+    result, error = None, None
+    try:
+        result = TEST_CASE_FUNCTIONS[key](recorder)
+    except Exception, inst:
+        try:
+            cPickle.dumps(inst)
+            error = inst
+        except Exception:
+            error = Exception(str(inst))
+    finally:
+        sys.stdout = stdout
+    recorder.flush()
+    return recorder.events, result, error
+
+class TestCaseScheduler:
+    """
+    Runs the test cases of each question in a pool of worker processes as
+    soon as the questions it depends on are complete.  The functions it
+    hands back wait for a test case and replay it, so questions still grade
+    their test cases in order and the output is that of a serial run.
+    """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.pool = None
+        self.testCases = {}
+        self.results = {}
+        self.completed = set()
+
+    def addTestCase(self, q, t, fun):
+        TEST_CASE_FUNCTIONS[(q, t)] = fun
+        self.testCases.setdefault(q, []).append((q, t))
+        def replay(grades):
+            events, result, error = self.results[(q, t)].get()
+            replayGrades(events, grades)
+            if error != None:
+                raise error
+            return result
+        return replay
+
+    def start(self, grades):
+        import multiprocessing
+        self.grades = grades
+        self.pool = multiprocessing.Pool(self.jobs)
+        for q in grades.questions:
+            self.submit(q)
+
+    def submit(self, q):
+        if len(self.grades.prereqs[q].difference(self.completed)) > 0:
+            return
+        for key in self.testCases.get(q, []):
+            if key not in self.results:
+                self.results[key] = self.pool.apply_async(runTestCaseFunction, (key,))
+
+    def complete(self, q):
+        self.completed.add(q)
+        for other in self.grades.questions:
+            self.submit(other)
+
+    def stop(self):
+        self.pool.terminate()
+
 # evaluate student code
 def evaluate(generateSolutions, testRoot, moduleDict, exceptionMap=ERROR_HINT_MAP, edxOutput=False, muteOutput=False,
-            printTestCase=False, questionToGrade=None, display=None):
+            printTestCase=False, questionToGrade=None, display=None, jobs=1):
     # imports of testbench code.  note that the testClasses import must follow
     # the import of student code due to dependencies
     import testParser
@@ -256,6 +364,9 @@ def evaluate(generateSolutions, testRoot, moduleDict, exceptionMap=ERROR_HINT_MA
 
     questions = []
     questionDicts = {}
+    scheduler = None
+    if jobs > 1:
+        scheduler = TestCaseScheduler(jobs)
     test_subdirs = getTestSubdirs(testParser, testRoot, questionToGrade)
     for q in test_subdirs:
         subdir_path = os.path.join(testRoot, q)
@@ -293,12 +404,19 @@ def evaluate(generateSolutions, testRoot, moduleDict, exceptionMap=ERROR_HINT_MA
                         return lambda grades: printTest(testDict, solutionDict) or testCase.execute(grades, moduleDict, solutionDict)
                     else:
                         return lambda grades: testCase.execute(grades, moduleDict, solutionDict)
-            question.addTestCase(testCase, makefun(testCase, solution_file))
+            if scheduler != None:
+                question.addTestCase(testCase, scheduler.addTestCase(q, t, makefun(testCase, solution_file)))
+            else:
+                question.addTestCase(testCase, makefun(testCase, solution_file))
 
         # Note extra function is necessary for scoping reasons
-        def makefun(question):
-            return lambda grades: question.execute(grades)
-        setattr(sys.modules[__name__], q, makefun(question))
+        def makefun(question, q):
+            def execute(grades):
+                question.execute(grades)
+                if scheduler != None and grades.points[q] >= grades.maxes[q]:
+                    scheduler.complete(q)
+            return execute
+        setattr(sys.modules[__name__], q, makefun(question, q))
         questions.append((q, question.getMaxPoints()))
 
     grades = grading.Grades(projectParams.PROJECT_NAME, questions, edxOutput=edxOutput, muteOutput=muteOutput)
@@ -307,7 +425,13 @@ def evaluate(generateSolutions, testRoot, moduleDict, exceptionMap=ERROR_HINT_MA
             for prereq in questionDicts[q].get('depends', '').split():
                 grades.addPrereq(q, prereq)
 
-    grades.grade(sys.modules[__name__], bonusPic = projectParams.BONUS_PIC)
+    if scheduler != None:
+        scheduler.start(grades)
+    try:
+        grades.grade(sys.modules[__name__], bonusPic = projectParams.BONUS_PIC)
+    finally:
+        if scheduler != None:
+            scheduler.stop()
     return grades.points
 
 
@@ -354,4 +478,5 @@ if __name__ == '__main__':
     else:
         evaluate(options.generateSolutions, options.testRoot, moduleDict,
             edxOutput=options.edxOutput, muteOutput=options.muteOutput, printTestCase=options.printTestCase,
-            questionToGrade=options.gradeQuestion, display=getDisplay(options.gradeQuestion!=None, options))
+            questionToGrade=options.gradeQuestion, display=getDisplay(options.gradeQuestion!=None, options),
+            jobs=options.jobs)
@@ -0,0 +1,267 @@
+# batchSimulator.py
+# -----------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to
+# http://inst.eecs.berkeley.edu/~cs188/pacman/pacman.html
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+A batch of classic Pacman games on one layout, stepped in lockstep with NumPy.
+
+Every game in the batch has the same agent to move, so one call to step()
+moves that agent in all the games that are not over yet.  The state lives in
+arrays with one row per game:
+
+  x, y          agent positions in half cells, so that scared ghosts moving
+                at half speed stay on integers
+  codes         agent direction codes (see Directions.CODES)
+  scaredTimers  ghost scared timers
+  food          one column per open cell of the layout
+  capsules      one column per capsule of the layout
+  scores, win, lose
+
+The rules are those of PacmanRules and GhostRules in pacman.py, applied in
+the same order, so a batch replaying the actions of games played by
+pacman.runGames ends with the same scores (see replayGames).  Actions are
+given as direction codes; legalMask returns the legal ones.
+
+NumPy is only needed by this module.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from game import Actions, Directions
+from game import SCARED_TIME, COLLISION_TOLERANCE, TIME_PENALTY
+
+NUM_CODES = len(Directions.NAMES)
+STOP_CODE = Directions.STOP_CODE
+
+class BatchSimulator:
+    """
+    numGames games of layout against numGhostAgents ghosts at most, as in
+    ClassicGameRules.newGame.  Random moves come from a numpy RandomState
+    seeded with seed.
+    """
+
+    def __init__(self, layout, numGames, numGhostAgents=4, seed=None):
+        if numpy == None:
+            raise Exception('The batch simulator needs NumPy')
+        self.layout = layout
+        self.numGames = numGames
+        self.random = numpy.random.RandomState(seed)
+        self.initializeTables()
+
+        self.starts = [layout.agentPositions[0][1]]
+        for isPacman, pos in layout.agentPositions[1:]:
+            if len(self.starts) > numGhostAgents: break
+            self.starts.append(pos)
+        self.numAgents = len(self.starts)
+        self.reset()
+
+    def initializeTables(self):
+        """
+        Numbers the open cells as layout.cells does and turns the layout's
+        action tables into masks indexed by cell and direction code.
+        """
+        layout = self.layout
+        numCells = len(layout.cells)
+        self.cellIds = numpy.zeros((layout.width, layout.height), numpy.int32) - 1
+        for i, (x, y) in enumerate(layout.cells):
+            self.cellIds[x, y] = i
+
+        self.pacmanLegal = numpy.zeros((numCells, NUM_CODES), bool)
+        self.ghostLegal = numpy.zeros((numCells, NUM_CODES, NUM_CODES), bool)
+        for i, cell in enumerate(layout.cells):
+            if cell not in layout.pacmanActions:
+                raise Exception('The batch simulator needs a layout with walls all around')
+            for action in layout.pacmanActions[cell]:
+                self.pacmanLegal[i, Directions.CODES[action]] = True
+            for code in range(NUM_CODES):
+                for action in layout.ghostActions[cell, code]:
+                    self.ghostLegal[i, code, Directions.CODES[action]] = True
+
+        self.dx = numpy.array([dx for dx, dy in Actions._vectors], numpy.int32)
+        self.dy = numpy.array([dy for dx, dy in Actions._vectors], numpy.int32)
+        self.layoutFood = numpy.array([layout.food[x][y] for x, y in layout.cells], bool)
+        self.capsuleIds = numpy.zeros(numCells, numpy.int32) - 1
+        for i, (x, y) in enumerate(layout.capsules):
+            self.capsuleIds[self.cellIds[x, y]] = i
+
+    def reset(self):
+        "Puts every game back at the start of the layout"
+        n, numAgents = self.numGames, self.numAgents
+        self.startX = numpy.array([2 * x for x, y in self.starts], numpy.int32)
+        self.startY = numpy.array([2 * y for x, y in self.starts], numpy.int32)
+        self.x = numpy.tile(self.startX, (n, 1))
+        self.y = numpy.tile(self.startY, (n, 1))
+        self.codes = numpy.zeros((n, numAgents), numpy.int32) + STOP_CODE
+        self.scaredTimers = numpy.zeros((n, numAgents), numpy.int32)
+        self.food = numpy.tile(self.layoutFood, (n, 1))
+        self.numFood = numpy.zeros(n, numpy.int32) + self.layoutFood.sum()
+        self.capsules = numpy.ones((n, len(self.layout.capsules)), bool)
+        self.scores = numpy.zeros(n, numpy.int32)
+        self.win = numpy.zeros(n, bool)
+        self.lose = numpy.zeros(n, bool)
+        self.numMoves = 0
+
+    def getNumAgents(self):
+        return self.numAgents
+
+    def isOver(self):
+        "Returns a boolean array that is True for the games that have ended"
+        return self.win | self.lose
+
+    def cells(self, agentIndex):
+        "The cell ids of agentIndex, rounding ghosts in between cells down"
+        return self.cellIds[self.x[:, agentIndex] // 2, self.y[:, agentIndex] // 2]
+
+    def legalMask(self, agentIndex):
+        """
+        Returns a (numGames, NUM_CODES) boolean array of the legal action
+        codes of agentIndex in every game.
+        """
+        cells = self.cells(agentIndex)
+        if agentIndex == 0:
+            return self.pacmanLegal[cells]
+        codes = self.codes[:, agentIndex]
+        mask = self.ghostLegal[cells, codes]
+        # In between grid points, ghosts must continue straight
+        between = (self.x[:, agentIndex] | self.y[:, agentIndex]) & 1 == 1
+        if between.any():
+            mask[between] = False
+            mask[between, codes[between]] = True
+        return mask
+
+    def randomActions(self, agentIndex):
+        """
+        Chooses a legal action code uniformly at random in every game, as
+        RandomGhost does.
+        """
+        counts = self.legalMask(agentIndex).cumsum(1)
+        choices = (self.random.random_sample(self.numGames) * counts[:, -1]).astype(numpy.int32)
+        return (counts > choices[:, None]).argmax(1)
+
+    def step(self, agentIndex, actions):
+        """
+        Applies the action codes of agentIndex to the games that are not
+        over, as GameState.generateSuccessor does.
+        """
+        active = ~(self.win | self.lose)
+        actions = numpy.asarray(actions, numpy.int32)
+        games = numpy.flatnonzero(active)
+        if not self.legalMask(agentIndex)[games, actions[games]].all():
+            raise Exception('Illegal action in the batch for agent %d' % agentIndex)
+        actions = actions[games]
+
+        if agentIndex == 0:
+            self.movePacman(games, actions)
+            self.scores[games] -= TIME_PENALTY
+            for index in range(1, self.numAgents):
+                self.checkDeath(games, index)
+        else:
+            self.moveGhost(games, actions, agentIndex)
+            self.decrementTimers(games, agentIndex)
+            self.checkDeath(games, agentIndex)
+        if agentIndex == self.numAgents - 1:
+            self.numMoves += 1
+
+    def movePacman(self, games, actions):
+        self.x[games, 0] += 2 * self.dx[actions]
+        self.y[games, 0] += 2 * self.dy[actions]
+        moving = actions != STOP_CODE
+        self.codes[games[moving], 0] = actions[moving]
+
+        # Eat food
+        cells = self.cellIds[self.x[games, 0] // 2, self.y[games, 0] // 2]
+        eaten = self.food[games, cells]
+        eating, cells = games[eaten], cells[eaten]
+        self.food[eating, cells] = False
+        self.scores[eating] += 10
+        self.numFood[eating] -= 1
+        won = eating[(self.numFood[eating] == 0) & ~self.lose[eating]]
+        self.scores[won] += 500
+        self.win[won] = True
+
+        # Eat capsules, which scares all the ghosts
+        cells = self.cellIds[self.x[games, 0] // 2, self.y[games, 0] // 2]
+        capsules = self.capsuleIds[cells]
+        eaten = capsules >= 0
+        eaten[eaten] = self.capsules[games[eaten], capsules[eaten]]
+        self.capsules[games[eaten], capsules[eaten]] = False
+        self.scaredTimers[games[eaten], 1:] = SCARED_TIME
+
+    def moveGhost(self, games, actions, agentIndex):
+        speed = numpy.where(self.scaredTimers[games, agentIndex] > 0, 1, 2)
+        self.x[games, agentIndex] += speed * self.dx[actions]
+        self.y[games, agentIndex] += speed * self.dy[actions]
+        moving = actions != STOP_CODE
+        self.codes[games[moving], agentIndex] = actions[moving]
+
+    def decrementTimers(self, games, agentIndex):
+        timers = self.scaredTimers[games, agentIndex]
+        snapping = games[timers == 1]
+        self.x[snapping, agentIndex] = (self.x[snapping, agentIndex] + 1) // 2 * 2
+        self.y[snapping, agentIndex] = (self.y[snapping, agentIndex] + 1) // 2 * 2
+        self.scaredTimers[games, agentIndex] = numpy.maximum(0, timers - 1)
+
+    def checkDeath(self, games, agentIndex):
+        distances = abs(self.x[games, agentIndex] - self.x[games, 0]) + abs(self.y[games, agentIndex] - self.y[games, 0])
+        colliding = games[distances <= 2 * COLLISION_TOLERANCE]
+        scared = self.scaredTimers[colliding, agentIndex] > 0
+
+        # Scared ghosts are eaten and go back to their start
+        eaten = colliding[scared]
+        self.scores[eaten] += 200
+        self.x[eaten, agentIndex] = self.startX[agentIndex]
+        self.y[eaten, agentIndex] = self.startY[agentIndex]
+        self.codes[eaten, agentIndex] = STOP_CODE
+        self.scaredTimers[eaten, agentIndex] = 0
+
+        killing = colliding[~scared & ~self.win[colliding]]
+        self.scores[killing] -= 500
+        self.lose[killing] = True
+
+    def run(self, maxMoves=None):
+        """
+        Plays every game to the end, or for at most maxMoves rounds, with a
+        random Pacman against RandomGhosts, and returns the scores.
+        """
+        while not self.isOver().all() and (maxMoves == None or self.numMoves < maxMoves):
+            for agentIndex in range(self.numAgents):
+                self.step(agentIndex, self.randomActions(agentIndex))
+        return self.scores
+
+def replayGames(layout, histories, numGhostAgents=4):
+    """
+    Replays the moveHistory of games played on layout, one game of the batch
+    per history, and returns the batch.  Raises an exception if a game of the
+    batch ends at a different move than the game it replays.
+    """
+    batch = BatchSimulator(layout, len(histories), numGhostAgents)
+    lengths = numpy.array([len(history) for history in histories])
+    move = 0
+    while not batch.isOver().all():
+        agentIndex = move % batch.getNumAgents()
+        actions = numpy.zeros(batch.numGames, numpy.int32) + STOP_CODE
+        for i, history in enumerate(histories):
+            if move < len(history):
+                index, action = history[move]
+                if index != agentIndex:
+                    raise Exception('Game %d moved agent %d out of turn' % (i, index))
+                actions[i] = Directions.CODES[action]
+        batch.step(agentIndex, actions)
+        move += 1
+        if (batch.isOver() != (lengths <= move)).any():
+            raise Exception('The batch and the games ended at different moves')
+    return batch
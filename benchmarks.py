@@ -0,0 +1,469 @@
+# benchmarks.py
+# -------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to
+# http://inst.eecs.berkeley.edu/~cs188/pacman/pacman.html
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Microbenchmarks for the game engine and the search agents.
+
+Each benchmark is a function that takes the parsed options and prints a
+small table.  Run one with, for example:
+
+  python benchmarks.py --benchmark successors --layouts mediumClassic,originalClassic
+
+and list them all with 'python benchmarks.py --help'.
+"""
+
+from pacman import GameState
+from game import Game
+import pacman, layout
+import gc, os, random, sys, time
+
+def loadLayouts(names):
+    layouts = []
+    for name in names.split(','):
+        lay = layout.getLayout(name)
+        if lay == None: raise Exception("The layout " + name + " cannot be found")
+        layouts.append((name, lay))
+    return layouts
+
+def randomPlayouts(lay, numSteps, seed):
+    """
+    Plays random legal moves for every agent from the start of the layout,
+    restarting whenever a game ends, and returns the states visited in order.
+    """
+    random.seed(seed)
+    start = GameState()
+    start.initialize(lay, lay.getNumGhosts())
+    states = []
+    state, agentIndex = start, 0
+    while len(states) < numSteps:
+        if state.isWin() or state.isLose():
+            state, agentIndex = start, 0
+            continue
+        action = random.choice(state.getLegalActions(agentIndex))
+        states.append((state, agentIndex, action))
+        state = state.generateSuccessor(agentIndex, action)
+        agentIndex = (agentIndex + 1) % state.getNumAgents()
+    GameState.getAndResetExplored()
+    return states
+
+def timeCalls(function, arguments, repeat):
+    "Returns the best of repeat timings of calling function on each argument"
+    best = float('inf')
+    for r in range(repeat):
+        start = time.time()
+        for args in arguments:
+            function(*args)
+        best = min(best, time.time() - start)
+        GameState.getAndResetExplored()
+    return best
+
+def benchmarkSuccessors(options):
+    """
+    Successor generation, legal actions and food counting on random
+    playouts.  generateSuccessor is timed on the same moves in each
+    GameState.explored mode: 'off', 'count' (Zobrist keys) and 'full' (the
+    states, as grading keeps them, and as every successor used to be kept);
+    'full/off' and 'full/count' are how many times faster the cheaper modes
+    are.  'recount' is the cost of Grid.count(), which is what getNumFood used
+    to do after every pellet; 'getNumFood' reads the counter kept in
+    GameStateData.
+    """
+    print '%-18s %12s %12s %12s %9s %10s %14s %14s %12s' % ('layout', 'off/s', 'count/s', 'full/s', 'full/off',
+                                                           'full/count', 'legalActions/s', 'getNumFood/s',
+                                                           'recount/s')
+    for name, lay in loadLayouts(options.layouts):
+        steps = randomPlayouts(lay, options.steps, options.seed)
+        successorTimes = []
+        for mode in ['off', 'count', 'full']:
+            previous = GameState.trackExplored(mode)
+            successorTimes.append(timeCalls(lambda s, i, a: s.generateSuccessor(i, a), steps, options.repeat))
+            GameState.trackExplored(previous)
+        legalTime = timeCalls(lambda s, i, a: s.getLegalActions(i), steps, options.repeat)
+        states = [(s,) for s, i, a in steps]
+        counterTime = timeCalls(lambda s: s.getNumFood(), states, options.repeat)
+        recountTime = timeCalls(lambda s: s.getFood().count(), states, options.repeat)
+        n = float(len(steps))
+        off, count, full = successorTimes
+        print '%-18s %12d %12d %12d %9.2f %10.2f %14d %14d %12d' % (name, n / off, n / count, n / full, full / off,
+                                                                   full / count, n / legalTime, n / counterTime,
+                                                                   n / recountTime)
+
+def benchmarkObservation(options):
+    """
+    The per-move cost of building the state an agent is shown: the old
+    deepCopy against Game._observe followed by Game._checkObserved.
+    """
+    print '%-18s %14s %14s' % ('layout', 'deepCopy/s', 'observe/s')
+    for name, lay in loadLayouts(options.layouts):
+        states = [(s,) for s, i, a in randomPlayouts(lay, options.steps, options.seed)]
+        game = Game([], None, None)
+        def observe(state):
+            game.state = state
+            game._observe()
+            game._checkObserved(0)
+        deepCopyTime = timeCalls(lambda s: s.deepCopy(), states, options.repeat)
+        observeTime = timeCalls(observe, states, options.repeat)
+        n = float(len(states))
+        print '%-18s %14d %14d' % (name, n / deepCopyTime, n / observeTime)
+
+def benchmarkGhosts(options):
+    """
+    DirectionalGhost.getDistribution on the ghost moves of random playouts,
+    working every distribution out as it used to ('compute') against the
+    lookup table, started empty ('table'), and getActionProbabilities once
+    the table is filled in ('lookup').  Raises an exception if the table and
+    the computed distributions ever differ.
+    """
+    import ghostAgents, util
+    def computed(ghost, state):
+        dist = util.Counter()
+        for action, prob in ghost.computeDistribution(state):
+            dist[action] = prob
+        return dist
+
+    print '%-18s %9s %12s %12s %12s %9s' % ('layout', 'calls', 'compute/s', 'table/s', 'lookup/s', 'entries')
+    for name, lay in loadLayouts(options.layouts):
+        ghosts = [ghostAgents.DirectionalGhost(i) for i in range(1, lay.getNumGhosts() + 1)]
+        calls = [(ghosts[i - 1], s) for s, i, a in randomPlayouts(lay, options.steps, options.seed) if i > 0]
+        ghostAgents.DirectionalGhost.tables.clear()
+        for ghost, state in calls:
+            if ghost.getDistribution(state) != computed(ghost, state):
+                raise Exception('The table and the computed distributions differ in\n%s' % state)
+        entries = sum([len(table) for layout, table in ghostAgents.DirectionalGhost.tables.values()])
+        computeTime = timeCalls(computed, calls, options.repeat)
+        tableTime = float('inf')
+        for r in range(options.repeat):
+            ghostAgents.DirectionalGhost.tables.clear()
+            tableTime = min(tableTime, timeCalls(lambda g, s: g.getDistribution(s), calls, 1))
+        lookupTime = timeCalls(lambda g, s: g.getActionProbabilities(s), calls, options.repeat)
+        n = float(len(calls))
+        print '%-18s %9d %12d %12d %12d %9d' % (name, n, n / computeTime, n / tableTime, n / lookupTime, entries)
+
+def benchmarkIncremental(options):
+    """
+    Searches every tenth Pacman state of random playouts with each agent
+    given evalFn=better and incremental=check, so every value worked out
+    incrementally is also computed in full and an exception is raised on
+    any mismatch.  Then times the same searches with incremental=False
+    ('full') and incremental=True ('incr'), and raises an exception if the
+    two ever choose different actions, e.g.
+
+      --agents "MinimaxAgent:depth=2;AlphaBetaAgent:depth=2;ExpectimaxAgent:depth=2"
+    """
+    def withOptions(spec, extra):
+        return spec + (',' if ':' in spec else ':') + 'evalFn=better,' + extra
+
+    print '%-18s %-56s %7s %10s %10s %8s' % ('layout', 'agent', 'states', 'full ms', 'incr ms', 'speedup')
+    for name, lay in loadLayouts(options.layouts):
+        states = [s for s, i, a in randomPlayouts(lay, options.steps, options.seed)
+                  if i == 0 and not (s.isWin() or s.isLose())][::10]
+        for spec in options.agents.split(';'):
+            checked = loadAgents(withOptions(spec, 'incremental=check'))[0][1]
+            checked.registerInitialState(states[0])
+            for state in states:
+                checked.getAction(state)
+            times, actions = [], []
+            for incremental in ['False', 'True']:
+                agent = loadAgents(withOptions(spec, 'incremental=' + incremental))[0][1]
+                agent.registerInitialState(states[0])
+                actions.append([agent.getAction(state) for state in states])
+                times.append(timeCalls(agent.getAction, [(state,) for state in states], options.repeat))
+            GameState.getAndResetExplored()
+            if actions[0] != actions[1]:
+                raise Exception('%s chooses different actions with incremental evaluation' % spec)
+            print '%-18s %-56s %7d %10.1f %10.1f %8.2f' % (name, spec, len(states), 1000 * times[0],
+                                                          1000 * times[1], times[0] / times[1])
+
+def residentMemory():
+    "Returns the resident memory of this process in bytes"
+    try:
+        f = open('/proc/self/statm')
+        try: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        finally: f.close()
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def benchmarkMemory(options):
+    """
+    Expands an expectimax tree breadth first from the start of each layout,
+    keeping every state, until --states states are held, and reports the
+    memory they take and the time it took to generate them, e.g.
+
+      --benchmark memory --layouts mediumClassic --states 1000000
+    """
+    print '%-18s %9s %10s %11s %12s' % ('layout', 'states', 'MB', 'bytes/state', 'states/s')
+    for name, lay in loadLayouts(options.layouts):
+        start = GameState()
+        start.initialize(lay, lay.getNumGhosts())
+        gc.collect()
+        memory = residentMemory()
+        startTime = time.time()
+        states = [start]
+        index = 0
+        while len(states) < options.states and index < len(states):
+            state = states[index]
+            agentIndex = index and (state.data._agentMoved + 1) % state.getNumAgents()
+            for action in state.getLegalActions(agentIndex):
+                states.append(state.generateSuccessor(agentIndex, action))
+            GameState.getAndResetExplored()
+            index += 1
+        elapsed = time.time() - startTime
+        memory = residentMemory() - memory
+        print '%-18s %9d %10.1f %11d %12d' % (name, len(states), memory / 1e6, memory / len(states), len(states) / elapsed)
+        del states
+
+def loadAgents(specs):
+    """
+    Parses 'AgentType:opt1=val1,opt2=val2;AgentType2' into (spec, agent) pairs.
+    """
+    agents = []
+    for spec in specs.split(';'):
+        if ':' in spec:
+            agentType, agentArgs = spec.split(':', 1)
+        else:
+            agentType, agentArgs = spec, None
+        agentClass = pacman.loadAgent(agentType, True)
+        agents.append((spec, agentClass(**pacman.parseAgentArgs(agentArgs))))
+    return agents
+
+def playTimed(lay, agent, ghosts, maxMoves):
+    """
+    Plays agent against ghosts for at most maxMoves Pacman moves and returns
+    the final state and the wall-clock time of each of agent's moves.
+    """
+    state = GameState()
+    state.initialize(lay, len(ghosts))
+    if 'registerInitialState' in dir(agent):
+        agent.registerInitialState(state.deepCopy())
+    times = []
+    while len(times) < maxMoves and not (state.isWin() or state.isLose()):
+        start = time.time()
+        action = agent.getAction(state.deepCopy())
+        times.append(time.time() - start)
+        state = state.generateSuccessor(0, action)
+        for ghost in ghosts:
+            if state.isWin() or state.isLose(): break
+            state = state.generateSuccessor(ghost.index, ghost.getAction(state))
+        GameState.getAndResetExplored()
+    return state, times
+
+def benchmarkAgents(options):
+    """
+    Plays one seeded game per agent on each layout and reports the time
+    each getAction call took.  Compare agent options with, for example:
+
+      --agents "AlphaBetaAgent:depth=3;AlphaBetaAgent:depth=3,ttSize=100000"
+    """
+    ghostType = pacman.loadAgent(options.ghosts, True)
+    print '%-18s %-60s %6s %9s %9s %8s' % ('layout', 'agent', 'moves', 'mean ms', 'max ms', 'score')
+    for name, lay in loadLayouts(options.layouts):
+        for spec, agent in loadAgents(options.agents):
+            ghosts = [ghostType(i + 1) for i in range(lay.getNumGhosts())]
+            random.seed(options.seed)
+            state, times = playTimed(lay, agent, ghosts, options.moves)
+            times = times or [0.0]
+            print '%-18s %-60s %6d %9.1f %9.1f %8d' % (name, spec, len(times), 1000 * sum(times) / len(times),
+                                                     1000 * max(times), state.getScore())
+
+def benchmarkParallel(options):
+    """
+    Plays the same seeded game with each agent at every worker count in
+    --workers and reports search nodes per second and move latency, e.g.
+
+      --layouts originalClassic --agents ExpectimaxAgent:depth=3 --workers 1,2,4,8
+    """
+    ghostType = pacman.loadAgent(options.ghosts, True)
+    print '%-18s %-40s %7s %6s %10s %9s %9s' % ('layout', 'agent', 'workers', 'moves', 'nodes/s', 'mean ms', 'max ms')
+    for name, lay in loadLayouts(options.layouts):
+        for spec in options.agents.split(';'):
+            for workers in options.workers.split(','):
+                separator = ':' not in spec and ':' or ','
+                agent = loadAgents(spec + separator + 'workers=' + workers)[0][1]
+                ghosts = [ghostType(i + 1) for i in range(lay.getNumGhosts())]
+                random.seed(options.seed)
+                state, times = playTimed(lay, agent, ghosts, options.moves)
+                if agent.pool != None:
+                    agent.pool.terminate()
+                times = times or [0.0]
+                print '%-18s %-40s %7s %6d %10d %9.1f %9.1f' % (name, spec, workers, len(times), agent.nodeCount / sum(times),
+                                                              1000 * sum(times) / len(times), 1000 * max(times))
+
+def deepeningSearches(agent, states):
+    """
+    Searches each state with agent, deepening one ply at a time up to its
+    depth with the previous best action first, and returns the values and
+    the successors generated in all the searches and in the last of each.
+    """
+    agent.registerInitialState(states[0])
+    values, nodes, last = [], 0, 0
+    for state in states:
+        agent.rootHint = None
+        agent.searchNodes = []
+        for depth in range(1, agent.depth + 1):
+            value, action = agent.countedSearch(state, depth)
+            agent.rootHint = action
+        values.append(value)
+        nodes += sum(agent.searchNodes)
+        last += agent.searchNodes[-1]
+        GameState.getAndResetExplored()
+    return values, nodes, last
+
+def benchmarkSearch(options):
+    """
+    Searches every tenth Pacman state of a random playout with each agent,
+    deepening one ply at a time up to the agent's depth with the previous
+    best action first, as chooseAction does under a time budget.  Reports
+    the successors generated in all the searches and in the last, the
+    effective branching factor (the last search's nodes per state to the
+    power 1 / plies) and whether the values match, up to rounding, those of
+    the same agent type with only its depth and evaluation function set, so
+    each optimization is checked against the plain search it speeds up, e.g.
+
+      --agents "AlphaBetaAgent:depth=3;AlphaBetaAgent:depth=3,ordering=killers"
+    """
+    print '%-18s %-56s %7s %10s %10s %6s %8s %6s' % ('layout', 'agent', 'states', 'nodes', 'last', 'ebf', 'ms', 'same')
+    for name, lay in loadLayouts(options.layouts):
+        states = [s for s, i, a in randomPlayouts(lay, options.steps, options.seed) if i == 0][::10]
+        references = {}
+        for spec, agent in loadAgents(options.agents):
+            start = time.time()
+            values, nodes, last = deepeningSearches(agent, states)
+            elapsed = time.time() - start
+            agentType, agentArgs = (spec + ':').split(':')[:2]
+            evalFn = pacman.parseAgentArgs(agentArgs or None).get('evalFn', 'scoreEvaluationFunction')
+            plain = '%s:depth=%d,evalFn=%s' % (agentType, agent.depth, evalFn)
+            if plain not in references:
+                references[plain] = deepeningSearches(loadAgents(plain)[0][1], states)[0]
+            # Incremental evaluation sums the same terms in another order
+            same = True not in [abs(v - r) > 1e-9 * max(1, abs(r)) for v, r in zip(values, references[plain])]
+            plies = agent.depth * lay.getNumGhosts() + agent.depth
+            print '%-18s %-56s %7d %10d %10d %6.2f %8.1f %6s' % (name, spec, len(states), nodes, last,
+                                                              (last / float(len(states))) ** (1.0 / plies),
+                                                              1000 * elapsed / len(states), same)
+
+def benchmarkBatch(options):
+    """
+    Checks the batch simulator against the engine and compares their speed.
+    The first --games games on each layout are played by pacman.runGames with
+    the first of --agents against RandomGhosts and replayed in one batch, which
+    must end every game at the same move with the same score.  Then --batch
+    random games are played to the end in the batch and in the engine, e.g.
+
+      --layouts smallClassic,mediumClassic --agents GreedyAgent --games 50 --batch 1000
+    """
+    import batchSimulator, ghostAgents, textDisplay, cStringIO
+    print '%-18s %6s %6s %9s %8s %12s %12s %10s %10s' % ('layout', 'games', 'agree', 'batch', 'moves',
+                                                           'batch/s', 'engine/s', 'batch avg', 'engine avg')
+    for name, lay in loadLayouts(options.layouts):
+        agent = loadAgents(options.agents)[0][1]
+        ghosts = [ghostAgents.RandomGhost(i + 1) for i in range(lay.getNumGhosts())]
+        random.seed(options.seed)
+        stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+        try: games = pacman.runGames(lay, agent, ghosts, textDisplay.NullGraphics(), options.games, False)
+        finally: sys.stdout = stdout
+        histories = [game.moveHistory for game in games]
+        batch = batchSimulator.replayGames(lay, histories, len(ghosts))
+        agree = sum(1 for i, game in enumerate(games) if batch.scores[i] == game.state.getScore()
+                    and batch.win[i] == game.state.isWin() and batch.lose[i] == game.state.isLose())
+
+        batch = batchSimulator.BatchSimulator(lay, options.batch, len(ghosts), options.seed)
+        start = time.time()
+        scores = batch.run()
+        batchTime = time.time() - start
+        batchMoves = batch.numMoves * batch.numGames
+
+        random.seed(options.seed)
+        initial = GameState()
+        initial.initialize(lay, len(ghosts))
+        start = time.time()
+        engineScores, engineMoves = [], 0
+        while time.time() - start < batchTime and len(engineScores) < options.batch:
+            state = initial
+            while not (state.isWin() or state.isLose()):
+                for agentIndex in range(state.getNumAgents()):
+                    state = state.generateSuccessor(agentIndex, random.choice(state.getLegalActions(agentIndex)))
+                    if state.isWin() or state.isLose(): break
+                engineMoves += 1
+            GameState.getAndResetExplored()
+            engineScores.append(state.getScore())
+        engineTime = time.time() - start
+        print '%-18s %6d %6d %9d %8d %12d %12d %10.1f %10.1f' % (name, len(games), agree, batch.numGames,
+                                                                   batch.numMoves, batchMoves / batchTime,
+                                                                   engineMoves / engineTime, scores.mean(),
+                                                                   sum(engineScores) / float(len(engineScores)))
+
+BENCHMARKS = {
+    'batch': benchmarkBatch,
+    'search': benchmarkSearch,
+    'successors': benchmarkSuccessors,
+    'observation': benchmarkObservation,
+    'memory': benchmarkMemory,
+    'agents': benchmarkAgents,
+    'parallel': benchmarkParallel,
+    'ghosts': benchmarkGhosts,
+    'incremental': benchmarkIncremental,
+}
+
+def readCommand( argv ):
+    """
+    Processes the command used to run the benchmarks from the command line.
+    """
+    from optparse import OptionParser
+    usageStr = """
+    USAGE:      python benchmarks.py <options>
+    BENCHMARKS: %s
+    """ % ', '.join(sorted(BENCHMARKS.keys()))
+    parser = OptionParser(usageStr)
+
+    parser.add_option('-b', '--benchmark', dest='benchmark',
+                      help='the BENCHMARK to run [Default: %default]', default='successors')
+    parser.add_option('-l', '--layouts', dest='layouts',
+                      help='comma separated LAYOUTS to run on [Default: %default]',
+                      metavar='LAYOUTS', default='mediumClassic,originalClassic')
+    parser.add_option('-s', '--steps', dest='steps', type='int',
+                      help='number of moves to sample per layout [Default: %default]', default=20000)
+    parser.add_option('-r', '--repeat', dest='repeat', type='int',
+                      help='timing repetitions, the best is reported [Default: %default]', default=3)
+    parser.add_option('--seed', dest='seed', type='int',
+                      help='random seed for the sampled playouts [Default: %default]', default=0)
+    parser.add_option('-a', '--agents', dest='agents',
+                      help='semicolon separated AGENTS as Type:opt1=val1,opt2=val2 [Default: %default]',
+                      metavar='AGENTS', default='AlphaBetaAgent:depth=2')
+    parser.add_option('-g', '--ghosts', dest='ghosts',
+                      help='the ghost agent TYPE to play against [Default: %default]',
+                      metavar='TYPE', default='DirectionalGhost')
+    parser.add_option('-w', '--workers', dest='workers',
+                      help='comma separated worker counts for the parallel benchmark [Default: %default]',
+                      default='1,2,4,8')
+    parser.add_option('-m', '--moves', dest='moves', type='int',
+                      help='maximum number of Pacman moves per game [Default: %default]', default=100)
+    parser.add_option('-n', '--states', dest='states', type='int',
+                      help='number of states the memory benchmark holds [Default: %default]', default=1000000)
+    parser.add_option('--games', dest='games', type='int',
+                      help='number of games the batch benchmark checks [Default: %default]', default=20)
+    parser.add_option('--batch', dest='batch', type='int',
+                      help='number of games the batch benchmark plays at once [Default: %default]', default=1000)
+
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    if options.benchmark not in BENCHMARKS:
+        raise Exception('Unknown benchmark ' + options.benchmark)
+    return options
+
+if __name__ == '__main__':
+    options = readCommand( sys.argv[1:] )
+    BENCHMARKS[options.benchmark]( options )
@@ -0,0 +1,136 @@
+# engineTests.py
+# --------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to
+# http://inst.eecs.berkeley.edu/~cs188/pacman/pacman.html
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Unit tests for the game engine and the search agents, which the autograder
+does not cover.  Run them with:
+
+  python engineTests.py
+"""
+
+from game import BitGrid, Game, Grid
+from pacman import GameState
+import ghostAgents, layout, multiAgents
+import cPickle, random, unittest
+
+class GameTest(unittest.TestCase):
+
+    def testBitGridColumns(self):
+        grid = BitGrid(3, 2)
+        grid[1][0] = True
+        self.assertTrue(grid[1] == [True, False])
+        self.assertFalse(grid[1] != [True, False])
+        self.assertTrue(grid[0] != [True, False])
+
+    def testObservationMatchesDeepCopy(self):
+        # The observation Game._observe shows an agent is a cheap copy, which
+        # must look the same as the deepCopy it replaced
+        random.seed(0)
+        lay = layout.getLayout('smallClassic')
+        state = GameState()
+        state.initialize(lay, lay.getNumGhosts())
+        game = Game([], None, None)
+        agentIndex, eaten = 0, 0
+        for i in range(1000):
+            if state.isWin() or state.isLose():
+                break
+            game.state = state
+            observed, copied = game._observe().data, state.deepCopy().data
+            self.assertEqual(observed, copied)
+            for name in ['_agentMoved', '_foodEaten', '_foodAdded', '_capsuleEaten', '_eaten', '_lose', '_win']:
+                self.assertEqual(getattr(observed, name), getattr(copied, name), name)
+            game._checkObserved(agentIndex)
+            if observed._foodEaten != None:
+                eaten += 1
+            state = state.generateSuccessor(agentIndex, random.choice(state.getLegalActions(agentIndex)))
+            agentIndex = (agentIndex + 1) % state.getNumAgents()
+        self.assertTrue(eaten > 0)
+
+class LayoutTest(unittest.TestCase):
+
+    def testOldRecording(self):
+        # Recordings made before layouts were interned pickled an old-style
+        # instance with the layout's attributes; this pickles one the same way
+        lay = layout.getLayout('testClassic')
+        class OldLayout:
+            pass
+        OldLayout.__module__, OldLayout.__name__ = 'layout', 'Layout'
+        old = OldLayout()
+        old.__dict__ = {'width': lay.width, 'height': lay.height,
+                        'walls': Grid(lay.width, lay.height, False), 'food': Grid(lay.width, lay.height, False),
+                        'capsules': list(lay.capsules), 'agentPositions': list(lay.agentPositions),
+                        'numGhosts': lay.numGhosts, 'layoutText': list(lay.layoutText)}
+        for x, y in lay.walls.asList():
+            old.walls[x][y] = True
+        for x, y in lay.food.asList():
+            old.food[x][y] = True
+        newLayout = layout.Layout
+        layout.Layout = OldLayout
+        try:
+            recording = cPickle.dumps({'layout': old, 'actions': []})
+        finally:
+            layout.Layout = newLayout
+
+        loaded = cPickle.loads(recording)['layout']
+        self.assertTrue(isinstance(loaded, layout.Layout))
+        self.assertEqual(loaded.walls, lay.walls)
+        self.assertEqual(loaded.food, lay.food)
+        self.assertEqual(loaded.agentPositions, lay.agentPositions)
+        self.assertEqual(loaded.mazeDistance((1, 1), (3, 1)), 2)
+        self.assertRaises(TypeError, setattr, loaded, 'width', 0)
+
+    def testPickleInterned(self):
+        lay = layout.getLayout('testClassic')
+        self.assertTrue(cPickle.loads(cPickle.dumps(lay)) is lay)
+
+    def testReadOnlyDistances(self):
+        lay = layout.getLayout('testClassic')
+        lay.mazeDistance((1, 1), (3, 1))
+        self.assertEqual(lay.distances.itemsize, 2)
+        self.assertRaises(TypeError, lay.distances.__setitem__, 0, 5)
+        self.assertRaises(TypeError, lay.distances.extend, [0])
+
+class MCTSTest(unittest.TestCase):
+
+    def replyCounts(self, scared, draws=2000):
+        # After Pacman moves east the ghost can go west towards him, east away
+        # from him or north, and only the first two are in the tree
+        lay = layout.Layout(['%%%%%%%', '%P....%', '%.%.%.%', '%..G..%', '%%%%%%%'])
+        state = GameState()
+        state.initialize(lay, 1)
+        afterPacman = state.generateSuccessor(0, 'East')
+        afterPacman.data.agentStates[1].scaredTimer = scared
+        ghost = ghostAgents.DirectionalGhost(1, prob_attack=0.99, prob_scaredFlee=0.99)
+        agent = multiAgents.MCTSAgent(ghostModel='directional')
+        agent.registerInitialState(state)
+        agent.ghosts = [ghost]
+        edge = multiAgents.MCTSEdge(afterPacman, [ghost.getDistribution(afterPacman)])
+        agent.expand(edge, ('West',))
+        agent.expand(edge, ('East',))
+        edge.visits = 3 # so no third reply is added
+        random.seed(0)
+        counts = {('West',): 0, ('East',): 0}
+        for i in range(draws):
+            counts[agent.sampleReplies(edge)] += 1
+        return counts
+
+    def testSaturatedRepliesFollowGhostModel(self):
+        attacking = self.replyCounts(0)
+        self.assertTrue(attacking[('West',)] > 0.95 * sum(attacking.values()))
+        fleeing = self.replyCounts(10)
+        self.assertTrue(fleeing[('East',)] > 0.95 * sum(fleeing.values()))
+
+if __name__ == '__main__':
+    unittest.main()
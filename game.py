@@ -25,6 +25,14 @@ from util import *
 import time, os
 import traceback
 import sys
+import random
+
+# Constants of the rules in pacman.py, kept here so that agents that simulate
+# the rules can import them without importing pacman.py a second time when it
+# runs as the main script
+SCARED_TIME = 40    # Moves ghosts are scared
+COLLISION_TOLERANCE = 0.7 # How close ghosts must be to Pacman to kill
+TIME_PENALTY = 1 # Number of points lost each round
 
 #######################
 # Parts worth reading #
@@ -68,7 +76,13 @@ class Directions:
                WEST: EAST,
                STOP: STOP}
 
-class Configuration:
+    # Integer codes for the directions, used inside the engine.  Agents
+    # only ever see and return the strings above.
+    CODES = {NORTH: 0, SOUTH: 1, EAST: 2, WEST: 3, STOP: 4}
+    NAMES = (NORTH, SOUTH, EAST, WEST, STOP)
+    STOP_CODE = 4
+
+class Configuration(object):
     """
     A Configuration holds the (x,y) coordinate of a character, along with its
     traveling direction.
@@ -76,16 +90,26 @@ class Configuration:
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
     """
+    __slots__ = ('pos', 'code')
 
     def __init__(self, pos, direction):
         self.pos = pos
-        self.direction = direction
+        self.code = Directions.CODES[direction]
+
+    def _getDirection(self):
+        return Directions.NAMES[self.code]
+
+    def _setDirection(self, direction):
+        self.code = Directions.CODES[direction]
+
+    # The direction is stored as its integer code (see Directions.CODES)
+    direction = property(_getDirection, _setDirection)
 
     def getPosition(self):
         return (self.pos)
 
     def getDirection(self):
-        return self.direction
+        return Directions.NAMES[self.code]
 
     def isInteger(self):
         x,y = self.pos
@@ -93,12 +117,11 @@ class Configuration:
 
     def __eq__(self, other):
         if other == None: return False
-        return (self.pos == other.pos and self.direction == other.direction)
+        return (self.pos == other.pos and self.code == other.code)
 
     def __hash__(self):
         x = hash(self.pos)
-        y = hash(self.direction)
-        return hash(x + 13 * y)
+        return hash(x + 13 * self.code)
 
     def __str__(self):
         return "(x,y)="+str(self.pos)+", "+str(self.direction)
@@ -118,10 +141,29 @@ class Configuration:
             direction = self.direction # There is no stop direction
         return Configuration((x + dx, y+dy), direction)
 
-class AgentState:
+    def step(self, code, speed):
+        """
+        Generates the configuration reached by moving speed cells in the
+        direction with the given code.  Equivalent to generateSuccessor with
+        the direction's vector, without working the direction back out.
+        """
+        x, y = self.pos
+        dx, dy = Actions._vectors[code]
+        conf = Configuration.__new__(Configuration)
+        conf.pos = (x + dx * speed, y + dy * speed)
+        if code == Directions.STOP_CODE:
+            code = self.code # There is no stop direction
+        conf.code = code
+        return conf
+
+class AgentState(object):
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
+
+    Like Configuration and GameStateData, AgentState uses __slots__, since a
+    search holds many of them and copies them for every successor.
     """
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying')
 
     def __init__( self, startConfiguration, isPacman ):
         self.start = startConfiguration
@@ -145,8 +187,10 @@ class AgentState:
         return hash(hash(self.configuration) + 13 * hash(self.scaredTimer))
 
     def copy( self ):
-        state = AgentState( self.start, self.isPacman )
+        state = AgentState.__new__( AgentState )
+        state.start = self.start
         state.configuration = self.configuration
+        state.isPacman = self.isPacman
         state.scaredTimer = self.scaredTimer
         state.numCarrying = self.numCarrying
         return state
@@ -273,6 +317,172 @@ class Grid:
                 bools.append(False)
         return bools
 
+class BitGrid(Grid, object):
+    """
+    A boolean Grid stored as a single arbitrary-precision integer (a bitboard).
+
+    Cell (x,y) lives in bit x * height + y, the same cell order used by
+    packBits, so hashing a BitGrid agrees with hashing the equivalent Grid.
+    Since the integer is immutable, copies share it and only pay for a new
+    integer when a cell is actually changed (copy-on-write).
+
+    Data is still accessed via grid[x][y]; grid[x] returns a lightweight
+    column view that reads and writes through to the bitboard.
+    """
+    __slots__ = ('width', 'height', 'bits')
+    CELLS_PER_INT = 30
+
+    def __init__(self, width, height, initialValue=False, bitRepresentation=None):
+        if initialValue not in [False, True]: raise Exception('Grids can only contain booleans')
+        self.width = width
+        self.height = height
+        self.bits = 0
+        if initialValue:
+            self.bits = (1 << (width * height)) - 1
+        if bitRepresentation:
+            self._unpackBits(bitRepresentation)
+
+    def __getitem__(self, i):
+        if i < 0: i += self.width
+        if i < 0 or i >= self.width: raise IndexError('grid index out of range')
+        return _BitGridColumn(self, i)
+
+    def __setitem__(self, key, item):
+        column = self[key]
+        for y in range(self.height):
+            column[y] = item[y]
+
+    def get(self, x, y):
+        "Fast equivalent of grid[x][y] for in-range coordinates"
+        return (self.bits >> (x * self.height + y)) & 1 == 1
+
+    def set(self, x, y, value):
+        "Fast equivalent of grid[x][y] = value for in-range coordinates"
+        if value:
+            self.bits |= 1 << (x * self.height + y)
+        else:
+            self.bits &= ~(1 << (x * self.height + y))
+
+    def _getData(self):
+        return [[self.get(x, y) for y in range(self.height)] for x in range(self.width)]
+
+    # Read-only list-of-lists view, for code written against Grid.data
+    data = property(_getData)
+
+    def __str__(self):
+        out = [[str(self.get(x, y))[0] for x in range(self.width)] for y in range(self.height)]
+        out.reverse()
+        return '\n'.join([''.join(x) for x in out])
+
+    def __eq__(self, other):
+        if other == None: return False
+        if isinstance(other, BitGrid):
+            return self.bits == other.bits and self.height == other.height and self.width == other.width
+        return self.data == other.data
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def copy(self):
+        g = BitGrid.__new__(BitGrid)
+        g.width = self.width
+        g.height = self.height
+        g.bits = self.bits
+        return g
+
+    def deepCopy(self):
+        return self.copy()
+
+    def shallowCopy(self):
+        return self.copy()
+
+    def freeze(self):
+        "Returns a read-only copy of the grid"
+        g = FrozenBitGrid(self.width, self.height)
+        g.bits = self.bits
+        return g
+
+    def count(self, item =True ):
+        """
+        Counts the cells set to item, one loop per set bit.  States keep the
+        number of food left in GameStateData.numFood, so this is only needed
+        for grids without such a counter.
+        """
+        numTrue = 0
+        bits = self.bits
+        while bits:
+            bits &= bits - 1
+            numTrue += 1
+        if item: return numTrue
+        return self.width * self.height - numTrue
+
+    def asList(self, key = True):
+        bits = self.bits
+        if not key:
+            bits ^= (1 << (self.width * self.height)) - 1
+        height = self.height
+        list = []
+        while bits:
+            low = bits & -bits
+            index = low.bit_length() - 1
+            list.append( (index / height, index % height) )
+            bits ^= low
+        return list
+
+class FrozenBitGrid(BitGrid):
+    """
+    A BitGrid that cannot be changed, used for the walls and food of a
+    Layout.  Its copies are ordinary BitGrids.
+    """
+    __slots__ = ()
+    def set(self, x, y, value):
+        raise TypeError('This grid is read-only; change a copy of it instead')
+
+class _BitGridColumn:
+    "A view of column x of a BitGrid, supporting grid[x][y] reads and writes"
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.x = x
+
+    def __getitem__(self, y):
+        height = self.grid.height
+        if y < 0: y += height
+        if y < 0 or y >= height: raise IndexError('grid index out of range')
+        return (self.grid.bits >> (self.x * height + y)) & 1 == 1
+
+    def __setitem__(self, y, value):
+        height = self.grid.height
+        if y < 0: y += height
+        if y < 0 or y >= height: raise IndexError('grid index out of range')
+        self.grid.set(self.x, y, value)
+
+    def __len__(self):
+        return self.grid.height
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+ZOBRIST_MASK = (1 << 64) - 1
+_zobristKeys = {}
+
+def zobristKey(item):
+    """
+    Returns the random 64-bit key for a hashable piece of a game state, such
+    as ('food', x, y).  Keys are derived from the item itself so that every
+    process agrees on them, and are cached after the first lookup.
+    """
+    try:
+        return _zobristKeys[item]
+    except KeyError:
+        key = _zobristKeys[item] = random.Random(hash(item)).getrandbits(64)
+        return key
+
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
         return bitRep
@@ -296,18 +506,14 @@ class Actions:
 
     _directionsAsList = _directions.items()
 
+    # The vectors and reverses of the directions, indexed by direction code
+    _vectors = tuple([_directions[direction] for direction in Directions.NAMES])
+    _reverseCodes = tuple([Directions.CODES[Directions.REVERSE[direction]] for direction in Directions.NAMES])
+
     TOLERANCE = .001
 
     def reverseDirection(action):
-        if action == Directions.NORTH:
-            return Directions.SOUTH
-        if action == Directions.SOUTH:
-            return Directions.NORTH
-        if action == Directions.EAST:
-            return Directions.WEST
-        if action == Directions.WEST:
-            return Directions.EAST
-        return action
+        return Directions.REVERSE.get(action, action)
     reverseDirection = staticmethod(reverseDirection)
 
     def vectorToDirection(vector):
@@ -367,10 +573,12 @@ class Actions:
         return (x + dx, y + dy)
     getSuccessor = staticmethod(getSuccessor)
 
-class GameStateData:
+class GameStateData(object):
     """
 
     """
+    __slots__ = ('food', 'capsules', 'agentStates', 'layout', '_eaten', 'score', 'numFood', '_zobrist',
+                 '_foodEaten', '_foodAdded', '_capsuleEaten', '_agentMoved', '_lose', '_win', 'scoreChange')
     def __init__( self, prevState = None ):
         """
         Generates a new data packet by copying information from its predecessor.
@@ -382,6 +590,8 @@ class GameStateData:
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            self.numFood = prevState.numFood
+            self._zobrist = prevState._zobrist
 
         self._foodEaten = None
         self._foodAdded = None
@@ -402,10 +612,7 @@ class GameStateData:
         return state
 
     def copyAgentStates( self, agentStates ):
-        copiedStates = []
-        for agentState in agentStates:
-            copiedStates.append( agentState.copy() )
-        return copiedStates
+        return [agentState.copy() for agentState in agentStates]
 
     def __eq__( self, other ):
         """
@@ -423,13 +630,67 @@ class GameStateData:
         """
         Allows states to be keys of dictionaries.
         """
-        for i, state in enumerate( self.agentStates ):
-            try:
-                int(hash(state))
-            except TypeError, e:
-                print e
-                #hash(state)
-        return int((hash(tuple(self.agentStates)) + 13*hash(self.food) + 113* hash(tuple(self.capsules)) + 7 * hash(self.score)) % 1048575 )
+        return self.zobrist()
+
+    def zobrist( self ):
+        """
+        A 64-bit Zobrist hash of everything that __eq__ compares: agent
+        configurations and scared timers, food, capsules and score.
+        """
+        # Scores are mixed in as integers when they are whole, since in
+        # CPython hash(-1) == hash(-2)
+        score = self.score
+        if score == int(score):
+            score = int(score)
+        else:
+            score = hash(score)
+        return self._zobrist ^ ((score * 0x9E3779B97F4A7C15) & ZOBRIST_MASK)
+
+    def _agentZobrist( self, index, agentState ):
+        conf = agentState.configuration
+        return zobristKey(('agent', index, conf.pos, conf.code)) ^ zobristKey(('scared', index, agentState.scaredTimer))
+
+    def computeZobrist( self ):
+        """
+        Computes the Zobrist hash (without the score) from scratch.
+        """
+        h = 0
+        for x, y in self.food.asList():
+            h ^= zobristKey(('food', x, y))
+        for x, y in self.capsules:
+            h ^= zobristKey(('capsule', x, y))
+        for index, agentState in enumerate( self.agentStates ):
+            h ^= self._agentZobrist( index, agentState )
+        return h
+
+    def updateZobrist( self, prevAgentStates, agentIndex ):
+        """
+        Updates the hash inherited from the previous state, whose agent states
+        were prevAgentStates, after agentIndex has moved.  Only the food,
+        capsule and agents that the move changed are touched.
+        """
+        h = self._zobrist
+        if self._foodEaten != None:
+            h ^= zobristKey(('food',) + tuple(self._foodEaten))
+        if self._capsuleEaten != None:
+            h ^= zobristKey(('capsule',) + tuple(self._capsuleEaten))
+        if agentIndex == 0 and (self._capsuleEaten != None or True in self._eaten):
+            changed = range( len( self.agentStates ) )
+        else:
+            changed = [agentIndex]
+        for index in changed:
+            old, new = prevAgentStates[index], self.agentStates[index]
+            if old.configuration is not new.configuration or old.scaredTimer != new.scaredTimer:
+                h ^= self._agentZobrist( index, old ) ^ self._agentZobrist( index, new )
+        self._zobrist = h
+
+    def snapshot( self ):
+        """
+        Returns an immutable value that is equal for two states exactly when
+        the states are equal, for recording states that are changed in place.
+        """
+        agents = tuple([(s.configuration.pos, s.configuration.code, s.scaredTimer) for s in self.agentStates])
+        return (agents, self.food, tuple(self.capsules), self.score)
 
     def __str__( self ):
         width, height = self.layout.width, self.layout.height
@@ -488,7 +749,8 @@ class GameStateData:
         Creates an initial game state from a layout array (see layout.py).
         """
         self.food = layout.food.copy()
-        self.capsules = layout.capsules[:]
+        self.numFood = self.food.count()
+        self.capsules = list(layout.capsules)
         self.layout = layout
         self.score = 0
         self.scoreChange = 0
@@ -501,6 +763,7 @@ class GameStateData:
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
         self._eaten = [False for a in self.agentStates]
+        self._zobrist = self.computeZobrist()
 
 try:
     import boinc
@@ -535,6 +798,39 @@ class Game:
         else:
             return self.rules.getProgress(self)
 
+    def _observe( self ):
+        """
+        Returns the state an agent is shown on its turn.  Rather than a
+        deepCopy, it is a copy that shares the layout and the agents'
+        configurations with the game's state, so _checkObserved must be
+        called once the agent is done with it.
+        """
+        data = self.state.data
+        self._observed = (data.snapshot(), data.layout.snapshot(), self._starts())
+        observation = self.state.copy()
+        observed = observation.data
+        # Rules set flags in this list in place when a ghost is eaten
+        observed._eaten = data._eaten[:]
+        # What the last move did, which deepCopy keeps for the displays
+        observed._agentMoved = data._agentMoved
+        observed._foodEaten = data._foodEaten
+        observed._foodAdded = data._foodAdded
+        observed._capsuleEaten = data._capsuleEaten
+        return observation
+
+    def _checkObserved( self, agentIndex ):
+        """
+        Rejects an agent that changed the game's state through the objects
+        its observation shares with it.
+        """
+        data = self.state.data
+        if (data.snapshot(), data.layout.snapshot(), self._starts()) != self._observed:
+            raise Exception('Agent %d changed the state of the game in place' % agentIndex)
+
+    def _starts( self ):
+        "The start configurations, which the agents' states share with the game's"
+        return tuple([(s.start.pos, s.start.direction) for s in self.state.data.agentStates])
+
     def _agentCrash( self, agentIndex, quiet=False):
         "Helper method for handling agent crashes"
         if not quiet: traceback.print_exc()
@@ -622,7 +918,7 @@ class Game:
                         timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
                         try:
                             start_time = time.time()
-                            observation = timed_func(self.state.deepCopy())
+                            observation = timed_func(self._observe())
                         except TimeoutFunctionException:
                             skip_action = True
                         move_time += time.time() - start_time
@@ -632,10 +928,10 @@ class Game:
                         self.unmute()
                         return
                 else:
-                    observation = agent.observationFunction(self.state.deepCopy())
+                    observation = agent.observationFunction(self._observe())
                 self.unmute()
             else:
-                observation = self.state.deepCopy()
+                observation = self._observe()
 
             # Solicit an action
             action = None
@@ -648,6 +944,7 @@ class Game:
                         if skip_action:
                             raise TimeoutFunctionException()
                         action = timed_func( observation )
+                        self._checkObserved(agentIndex)
                     except TimeoutFunctionException:
                         print >>sys.stderr, "Agent %d timed out on a single move!" % agentIndex
                         self.agentTimeout = True
@@ -682,6 +979,7 @@ class Game:
                     return
             else:
                 action = agent.getAction(observation)
+                self._checkObserved(agentIndex)
             self.unmute()
 
             # Execute the action
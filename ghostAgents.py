@@ -45,12 +45,53 @@ class RandomGhost( GhostAgent ):
 
 class DirectionalGhost( GhostAgent ):
     "A ghost that prefers to rush Pacman, or flee when scared."
+
+    # For each (prob_attack, prob_scaredFlee), the layout last played and a
+    # table of distributions on it; see getActionProbabilities
+    tables = {}
+    TABLE_SIZE = 100000
+
     def __init__( self, index, prob_attack=0.8, prob_scaredFlee=0.8 ):
         self.index = index
         self.prob_attack = prob_attack
         self.prob_scaredFlee = prob_scaredFlee
 
     def getDistribution( self, state ):
+        dist = util.Counter()
+        for action, prob in self.getActionProbabilities( state ):
+            dist[action] = prob
+        return dist
+
+    def getActionProbabilities( self, state ):
+        """
+        Returns the distribution of getDistribution as a tuple of (action,
+        probability) pairs.  The distribution only depends on the ghost's
+        position and direction, Pacman's position and whether the ghost is
+        scared, so it is looked up in a table of them for the layout of
+        state, which is filled in as positions come up and emptied when it
+        holds TABLE_SIZE distributions.
+        """
+        if state.isWin() or state.isLose():
+            return self.computeDistribution( state )
+        ghostState = state.data.agentStates[self.index]
+        conf = ghostState.configuration
+        key = (conf.pos, conf.code, state.getPacmanPosition(), ghostState.scaredTimer > 0)
+        probs = (self.prob_attack, self.prob_scaredFlee)
+        layout, table = DirectionalGhost.tables.get( probs, (None, None) )
+        if layout is not state.data.layout:
+            layout, table = DirectionalGhost.tables[probs] = (state.data.layout, {})
+        distribution = table.get( key )
+        if distribution == None:
+            if len( table ) >= DirectionalGhost.TABLE_SIZE:
+                table.clear()
+            distribution = table[key] = self.computeDistribution( state )
+        return distribution
+
+    def computeDistribution( self, state ):
+        """
+        Works out the distribution of getActionProbabilities, with the
+        actions in the order they are first given a probability.
+        """
         # Read variables from state
         ghostState = state.getGhostState( self.index )
         legalActions = state.getLegalActions( self.index )
@@ -79,4 +120,5 @@ class DirectionalGhost( GhostAgent ):
         for a in bestActions: dist[a] = bestProb / len(bestActions)
         for a in legalActions: dist[a] += ( 1-bestProb ) / len(legalActions)
         dist.normalize()
-        return dist
+        order = bestActions + [a for a in legalActions if a not in bestActions]
+        return tuple( [(a, dist[a]) for a in order] )
@@ -14,28 +14,130 @@
 
 
 from util import manhattanDistance
+from util import nearestPoint
 from game import Grid
+from game import BitGrid
+from game import Actions, Configuration, Directions
+from array import array
+import hashlib
 import os
 import random
+import tempfile
 
 VISIBILITY_MATRIX_CACHE = {}
+LAYOUT_CACHE = {}
+DISTANCE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'pacman-distances')
+DISTANCE_FORMAT = 1 # Changes whenever the cell order or the array type does
+UNREACHABLE = 0xFFFF
 
-class Layout:
+class ReadOnlyDict(dict):
+    """
+    A dict that raises TypeError on any change, for the tables of a Layout
+    that every game state shares.  Lookups are those of a dict.
+    """
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError('This table is read-only')
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readOnly
+
+    def __reduce__(self):
+        return (ReadOnlyDict, (dict(self),))
+
+class ReadOnlyArray(array):
+    """
+    An array that raises TypeError on any change, for the maze distances of
+    a Layout.  It keeps the compact storage and the lookups of an array.
+    """
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError('This table is read-only')
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _readOnly
+    append = byteswap = extend = fromfile = fromlist = fromstring = fromunicode = _readOnly
+    insert = pop = read = remove = reverse = _readOnly
+
+    def __reduce__(self):
+        return (ReadOnlyArray, (self.typecode, self.tostring()))
+
+class Layout(object):
     """
     A Layout manages the static information about the game board.
+
+    Layouts are immutable and interned: constructing a Layout from the text
+    of one that already exists returns the existing object, so game states
+    share a single Layout however often they are copied.  Besides the
+    read-only walls and food grids it holds data precomputed for the maze:
+
+      cells      - the open positions, in the order of their ids
+      cellIndex  - maps each open position to its id
+      neighbors  - for each cell id, the ids of the adjacent open cells
+      corners    - the four inner corners of the board
+
+    and the legal action tables used by the rules in pacman.py:
+
+      pacmanActions - maps each open position to its legal actions
+      ghostActions  - maps (position, code of the direction the ghost faces) to
+                      the ghost's legal actions, with STOP and reversing
+                      already removed
+
+    The tables are tuples and ReadOnlyDicts, and the maze distances (computed
+    the first time they are needed) a ReadOnlyArray, so none can be changed, and
+    setting any attribute of a built layout raises TypeError.  This is what
+    makes it safe to share one Layout between all the games on its text.
     """
 
-    def __init__(self, layoutText):
+    def __new__(cls, layoutText=None):
+        # Recordings pickled before layouts were interned call Layout() and
+        # then restore the old attributes, which __setstate__ rebuilds from
+        if layoutText == None:
+            return object.__new__(cls)
+        key = hashlib.sha1('\n'.join(layoutText)).hexdigest()
+        if key not in LAYOUT_CACHE:
+            layout = object.__new__(cls)
+            layout.initialize(list(layoutText), key)
+            LAYOUT_CACHE[key] = layout
+        return LAYOUT_CACHE[key]
+
+    def __reduce__(self):
+        # Unpickling goes through __new__, so it finds the interned layout
+        return (Layout, (self.layoutText,))
+
+    def __setstate__(self, state):
+        # Shares the tables of the interned layout with the same text, much as
+        # __new__ would have returned it
+        self.__dict__.update(Layout(state['layoutText']).__dict__)
+
+    def __setattr__(self, name, value):
+        # Every game on the same text shares the layout, so once it is built
+        # only the layout itself fills in the tables computed when first needed
+        if self.__dict__.get('_frozen'):
+            raise TypeError('Layouts are read-only; %s cannot be changed' % name)
+        object.__setattr__(self, name, value)
+
+    def initialize(self, layoutText, key):
+        self.key = key
         self.width = len(layoutText[0])
         self.height= len(layoutText)
-        self.walls = Grid(self.width, self.height, False)
-        self.food = Grid(self.width, self.height, False)
+        self.walls = BitGrid(self.width, self.height, False)
+        self.food = BitGrid(self.width, self.height, False)
         self.capsules = []
         self.agentPositions = []
         self.numGhosts = 0
         self.processLayoutText(layoutText)
-        self.layoutText = layoutText
+        self.layoutText = tuple(layoutText)
+        self.walls = self.walls.freeze()
+        self.food = self.food.freeze()
+        self.capsules = tuple(self.capsules)
+        self.agentPositions = tuple(self.agentPositions)
+        self.cells = tuple([(x, y) for x in range(self.width) for y in range(self.height) if not self.walls[x][y]])
+        self.cellIndex = ReadOnlyDict((cell, i) for i, cell in enumerate(self.cells))
+        neighbors = []
+        for x, y in self.cells:
+            adjacent = [(x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)]
+            neighbors.append(tuple([self.cellIndex[cell] for cell in adjacent if cell in self.cellIndex]))
+        self.neighbors = tuple(neighbors)
+        self.corners = ((1, 1), (1, self.height - 2), (self.width - 2, 1), (self.width - 2, self.height - 2))
+        self.initializeActions()
+        self.distances = None
         # self.initializeVisibilityMatrix()
+        self._frozen = True
 
     def getNumGhosts(self):
         return self.numGhosts
@@ -56,10 +158,126 @@ class Layout:
                             while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)] :
                                 vis[x][y][direction].add((nextx, nexty))
                                 nextx, nexty = x + dx, y + dy
-            self.visibility = vis
+            object.__setattr__(self, 'visibility', vis)
             VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
         else:
-            self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
+            object.__setattr__(self, 'visibility', VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)])
+
+    def initializeActions(self):
+        """
+        Builds pacmanActions and ghostActions with Actions.getPossibleActions
+        and the ghost rules, so the tables list actions in the same order the
+        rules would.  Cells next to the edge of an unwalled board are left out
+        and handled by the rules directly.
+        """
+        pacmanActions = {}
+        ghostActionTable = {}
+        for cell in self.cells:
+            try:
+                possible = Actions.getPossibleActions(Configuration(cell, Directions.STOP), self.walls)
+            except IndexError:
+                continue
+            pacmanActions[cell] = tuple(possible)
+            for direction in Actions._directions:
+                ghostActions = [action for action in possible if action != Directions.STOP]
+                reverse = Actions.reverseDirection(direction)
+                if reverse in ghostActions and len(ghostActions) > 1:
+                    ghostActions.remove(reverse)
+                ghostActionTable[cell, Directions.CODES[direction]] = tuple(ghostActions)
+        self.pacmanActions = ReadOnlyDict(pacmanActions)
+        self.ghostActions = ReadOnlyDict(ghostActionTable)
+
+    def initializeDistances(self):
+        """
+        Runs a breadth first search from every open cell and stores the maze
+        distances in a flat ReadOnlyArray indexed by cellIndex[pos1] * n + cellIndex[pos2].
+        The array is cached on disk in DISTANCE_CACHE_DIR under the layout's
+        key, so each maze is only searched once.  A cached array that does
+        not look right is ignored and searched again.
+        """
+        distances = self.loadDistances(self.key, len(self.cells))
+        if distances == None:
+            distances = self.computeDistances()
+            self.saveDistances(self.key, distances)
+        # Read-only, since every state and agent shares it
+        object.__setattr__(self, 'distances', ReadOnlyArray(distances.typecode, distances.tostring()))
+
+    def computeDistances(self):
+        n = len(self.cells)
+        neighbors = self.neighbors
+        distances = array('H', [UNREACHABLE]) * (n * n)
+        for source in range(n):
+            row = source * n
+            distances[row + source] = 0
+            frontier = [source]
+            dist = 0
+            while frontier:
+                dist += 1
+                nextFrontier = []
+                for cell in frontier:
+                    for neighbor in neighbors[cell]:
+                        if distances[row + neighbor] == UNREACHABLE:
+                            distances[row + neighbor] = dist
+                            nextFrontier.append(neighbor)
+                frontier = nextFrontier
+        return distances
+
+    def distancesPath(self, key, n):
+        """
+        The cache file of the distances, named by everything they depend on:
+        the layout text, the format, the number of cells and the item size.
+        """
+        name = '%s-v%d-%d-%d.dist' % (key, DISTANCE_FORMAT, n, array('H').itemsize)
+        return os.path.join(DISTANCE_CACHE_DIR, name)
+
+    def loadDistances(self, key, n):
+        """
+        Returns the cached distances, or None unless the file holds exactly
+        n * n of them with 0 from every cell to itself.
+        """
+        path = self.distancesPath(key, n)
+        if not os.path.exists(path): return None
+        distances = array('H')
+        f = open(path, 'rb')
+        try:
+            distances.fromfile(f, n * n)
+            if f.read(1): return None
+        except (EOFError, IOError):
+            return None
+        finally:
+            f.close()
+        if len(distances) != n * n: return None
+        for i in range(n):
+            if distances[i * n + i] != 0: return None
+        return distances
+
+    def saveDistances(self, key, distances):
+        # Write to a private file and rename it so concurrent games never
+        # read a partial matrix.  A failure only costs the next run a search.
+        try:
+            if not os.path.isdir(DISTANCE_CACHE_DIR):
+                os.makedirs(DISTANCE_CACHE_DIR)
+            path = self.distancesPath(key, len(self.cells))
+            partial = '%s.%d' % (path, os.getpid())
+            f = open(partial, 'wb')
+            try: distances.tofile(f)
+            finally: f.close()
+            os.rename(partial, path)
+        except (IOError, OSError):
+            pass
+
+    def mazeDistance(self, pos1, pos2):
+        """
+        Returns the length of the shortest path between pos1 and pos2 that
+        avoids walls, or float('inf') if there is none.  Positions between
+        cells, such as those of scared ghosts, count as the nearest cell.
+        """
+        if self.distances == None: self.initializeDistances()
+        i = self.cellIndex[nearestPoint(pos1)]
+        j = self.cellIndex[nearestPoint(pos2)]
+        dist = self.distances[i * len(self.cellIndex) + j]
+        if dist == UNREACHABLE: return float('inf')
+        return dist
 
     def isWall(self, pos):
         x, col = pos
@@ -74,23 +292,26 @@ class Layout:
         return (x,y)
 
     def getRandomCorner(self):
-        poses = [(1,1), (1, self.height - 2), (self.width - 2, 1), (self.width - 2, self.height - 2)]
-        return random.choice(poses)
+        return random.choice(self.corners)
 
     def getFurthestCorner(self, pacPos):
-        poses = [(1,1), (1, self.height - 2), (self.width - 2, 1), (self.width - 2, self.height - 2)]
-        dist, pos = max([(manhattanDistance(p, pacPos), p) for p in poses])
+        dist, pos = max([(manhattanDistance(p, pacPos), p) for p in self.corners])
         return pos
 
     def isVisibleFrom(self, ghostPos, pacPos, pacDirection):
         row, col = [int(x) for x in pacPos]
         return ghostPos in self.visibility[row][col][pacDirection]
 
+    def snapshot(self):
+        "Returns an immutable value that changes if the layout is changed in place"
+        return (self.walls.bits, self.food.bits, tuple(self.capsules), tuple(self.agentPositions))
+
     def __str__(self):
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        # Layouts are immutable, so a copy can be the layout itself
+        return self
 
     def processLayoutText(self, layoutText):
         """
@@ -14,8 +14,17 @@
 
 
 from util import manhattanDistance
-from game import Directions
-import random, util
+from game import Directions, Actions
+from game import SCARED_TIME, COLLISION_TOLERANCE, TIME_PENALTY
+import random, util, time, math, sys, json
+import multiprocessing, binascii
+import ghostAgents
+from layout import UNREACHABLE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from game import Agent
 
@@ -79,6 +88,7 @@ class ReflexAgent(Agent):
         "*** YOUR CODE HERE ***"
         newGhostPos = successorGameState.getGhostPositions()
         currentFood = newFood.asList()
+        mazeDistance = successorGameState.data.layout.mazeDistance
         disToGhost = 0
         for pos in newGhostPos:
             dis = manhattanDistance(newPos, pos)
@@ -86,7 +96,7 @@ class ReflexAgent(Agent):
                 disToGhost += 1.0 / dis
         foodToFood = 0
         for food in currentFood:
-            foodToFood += 1.0 / manhattanDistance(newPos, food)
+            foodToFood += 1.0 / mazeDistance(newPos, food)
         scoreDif = successorGameState.getScore()
         result = scoreDif + foodToFood - disToGhost
         return result
@@ -102,6 +112,107 @@ def scoreEvaluationFunction(currentGameState):
     """
     return currentGameState.getScore()
 
+def orderActions(actions, first):
+    """
+      Returns actions with first, if it is one of them, moved to the front.
+    """
+    if first in actions and actions[0] != first:
+        actions.remove(first)
+        actions.insert(0, first)
+    return actions
+
+class SearchTimeout(Exception):
+    "Raised inside a search when the time budget for the move has run out"
+    pass
+
+class SearchStats:
+    """
+      The work of one move of a MultiAgentSearchAgent: successors generated
+      at each ply below the root, cutoffs, evaluation calls, the time spent
+      generating successors and evaluating, and the deepest ply reached.
+
+      install() shadows the agent's successor, restore, cutoff and
+      evaluationFunction with counting versions and uninstall() removes
+      them, so an agent without stats runs the plain methods.  Work done
+      in the worker processes of workers=N is not seen.  With evalCache
+      set, the hits and misses of the cache are recorded too.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.nodesPerPly = []
+        self.ply = 0
+        self.cutoffs = 0
+        self.evalCalls = 0
+        self.successorTime = 0.0
+        self.evalTime = 0.0
+        self.start = time.time()
+
+    def install(self):
+        agent = self.agent
+        successor, restore, evaluate = agent.successor, agent.restore, agent.evaluationFunction
+        self.evaluationFunction = evaluate
+        if agent.evalCache != None:
+            self.cacheCounts = (agent.evalCache.hits, agent.evalCache.misses)
+
+        def countedSuccessor(state, agentIndex, action):
+            start = time.time()
+            result = successor(state, agentIndex, action)
+            self.successorTime += time.time() - start
+            if self.ply == len(self.nodesPerPly):
+                self.nodesPerPly.append(0)
+            self.nodesPerPly[self.ply] += 1
+            self.ply += 1
+            return result
+
+        def countedRestore(state):
+            self.ply -= 1
+            restore(state)
+
+        def countedEvaluation(state):
+            start = time.time()
+            result = evaluate(state)
+            self.evalTime += time.time() - start
+            self.evalCalls += 1
+            return result
+
+        def countedCutoff():
+            self.cutoffs += 1
+
+        agent.successor = countedSuccessor
+        agent.restore = countedRestore
+        agent.evaluationFunction = countedEvaluation
+        agent.cutoff = countedCutoff
+
+        evaluateBatch = self.evaluateBatch = agent.evaluateBatch
+        def countedBatch(states):
+            start = time.time()
+            result = evaluateBatch(states)
+            self.evalTime += time.time() - start
+            self.evalCalls += len(states)
+            return result
+
+        if evaluateBatch != None:
+            agent.evaluateBatch = countedBatch
+
+    def uninstall(self):
+        agent = self.agent
+        del agent.successor, agent.restore, agent.cutoff
+        agent.evaluationFunction = self.evaluationFunction
+        agent.evaluateBatch = self.evaluateBatch
+
+    def record(self):
+        "Returns the stats as a dictionary for json"
+        agent = self.agent
+        record = {'agent': agent.__class__.__name__, 'move': agent.moveNumber, 'depth': agent.completedDepth,
+                  'nodes': sum(self.nodesPerPly), 'nodesPerPly': self.nodesPerPly, 'maxDepth': len(self.nodesPerPly),
+                  'cutoffs': self.cutoffs, 'evalCalls': self.evalCalls, 'successorTime': round(self.successorTime, 6),
+                  'evalTime': round(self.evalTime, 6), 'time': round(time.time() - self.start, 6)}
+        if agent.evalCache != None:
+            record['evalCacheHits'] = agent.evalCache.hits - self.cacheCounts[0]
+            record['evalCacheMisses'] = agent.evalCache.misses - self.cacheCounts[1]
+        return record
+
 class MultiAgentSearchAgent(Agent):
     """
       This class provides some common elements to all of your
@@ -117,10 +228,263 @@ class MultiAgentSearchAgent(Agent):
       is another abstract class.
     """
 
-    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2'):
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', inPlace = 'False',
+                 ttSize = '0', ttReplace = 'depth', timeBudget = '0', workers = '0', stats = '',
+                 evalCache = '0', incremental = 'False', batchEval = 'False'):
         self.index = 0 # Pacman is always agent index 0
         self.evaluationFunction = util.lookup(evalFn, globals())
+        # With incremental=True (or check, to compare with the full values) the
+        # features of betterEvaluationFunction are updated along the search path
+        self.incremental = None
+        if str(incremental).lower() in ['true', '1', 'check']:
+            if self.evaluationFunction != betterEvaluationFunction:
+                raise Exception('incremental=%s needs evalFn=better' % incremental)
+            self.incremental = IncrementalEvaluation(str(incremental).lower() == 'check')
+            self.evaluationFunction = self.incremental
+        # With batchEval=True (or check) minimax and expectimax evaluate the
+        # leaves below a node with one call of evaluateBatch
+        self.evaluateBatch = None
+        if str(batchEval).lower() in ['true', '1', 'check']:
+            if util.lookup(evalFn, globals()) != betterEvaluationFunction:
+                raise Exception('batchEval=%s needs evalFn=better' % batchEval)
+            self.evaluateBatch = BatchEvaluation(str(batchEval).lower() == 'check')
+        # With evalCache=N, the values of the N most recently evaluated states are kept
+        self.evalCache = None
+        if int(evalCache) > 0:
+            self.evalCache = util.EvaluationCache(self.evaluationFunction, int(evalCache))
+            self.evaluationFunction = self.evalCache
         self.depth = int(depth)
+        self.inPlace = str(inPlace).lower() in ['true', '1']
+        self.ttSize = int(ttSize)
+        self.ttReplace = ttReplace
+        self.table = None
+        self.timeBudget = float(timeBudget)
+        self.deadline = None
+        self.rootHint = None
+        self.depthCutoff = False
+        self.completedDepth = 0
+        self.workers = int(workers)
+        self.pool = None
+        self.nodeCount = 0
+        self.searchNodes = []
+        self.stats = stats
+        self.statsStream = None
+        self.moveNumber = 0
+
+    def registerInitialState(self, gameState):
+        # Search results and values are only reused within a single game;
+        # Zobrist keys don't tell layouts apart
+        self.table = None
+        if self.evalCache != None:
+            self.evalCache.clear()
+        self.moveNumber = 0
+        self.closeStats()
+        self.parallelPool()
+
+    def final(self, gameState):
+        "Called by the game when it ends"
+        self.closeStats()
+
+    def closeStats(self):
+        "Closes the file that stats are written to, which reopens on the next move"
+        if self.statsStream != None and self.statsStream != sys.stdout:
+            self.statsStream.close()
+        self.statsStream = None
+
+    def chooseAction(self, gameState):
+        """
+          Returns the action to take from gameState.
+
+          Normally this is the action of a search self.depth plies deep.  With
+          timeBudget set (in seconds), it searches 1, 2, 3, ... plies deep
+          until the budget runs out and returns the action of the deepest
+          search that finished.  AlphaBetaAgent tries the previous search's
+          best action first, which is where iterating pays off; minimax and
+          expectimax search every action anyway.  The first search always
+          runs to completion.
+
+          With stats set to a file name, or - for standard output, a JSON line
+          of SearchStats is written for every move.
+        """
+        self.moveNumber += 1
+        if not self.stats:
+            return self.searchAction(gameState)
+        stats = SearchStats(self)
+        stats.install()
+        try:
+            action = self.searchAction(gameState)
+        finally:
+            stats.uninstall()
+        if self.statsStream == None:
+            self.statsStream = self.stats == '-' and sys.stdout or open(self.stats, 'a')
+        self.statsStream.write(json.dumps(stats.record(), sort_keys=True) + '\n')
+        self.statsStream.flush()
+        return action
+
+    def searchAction(self, gameState):
+        "The search of chooseAction"
+        self.rootHint = None
+        self.searchNodes = []
+        if self.timeBudget <= 0:
+            self.completedDepth = self.depth
+            return self.countedSearch(gameState, self.depth)[1]
+
+        start = time.time()
+        action, depth = None, 0
+        try:
+            while True:
+                depth += 1
+                self.depthCutoff = False
+                action = self.countedSearch(gameState, depth)[1]
+                self.rootHint = action
+                self.completedDepth = depth
+                # A search that never hit the depth limit saw the whole tree
+                if not self.depthCutoff:
+                    break
+                self.deadline = start + self.timeBudget
+                if time.time() > self.deadline:
+                    break
+        except SearchTimeout:
+            pass
+        self.deadline = None
+        return action
+
+    def countedSearch(self, gameState, maxDepth):
+        """
+          Returns searchDepth(gameState, maxDepth) and appends the number of
+          successors it generated to self.searchNodes, from which the
+          effective branching factor of each search can be worked out.
+        """
+        nodes = self.nodeCount
+        result = self.searchDepth(gameState, maxDepth)
+        self.searchNodes.append(self.nodeCount - nodes)
+        return result
+
+    def transpositionTable(self, gameState):
+        """
+          Returns the transposition table to search gameState with, or None
+          if ttSize is 0 or the state has no Zobrist hash.  The table is
+          kept across calls to getAction for the rest of the game.
+        """
+        if self.ttSize <= 0 or not hasattr(gameState, 'zobrist'):
+            return None
+        if self.table == None:
+            self.table = util.TranspositionTable(self.ttSize, self.ttReplace)
+        return self.table
+
+    def searchRoot(self, gameState):
+        """
+          Returns the state to start searching from.  With inPlace=True,
+          successors are made with push/pop on a private copy of gameState
+          instead of generateSuccessor, when the state supports it.  The
+          path of incremental evaluation starts here too.
+        """
+        self.searchInPlace = self.inPlace and hasattr(gameState, 'push')
+        if self.searchInPlace:
+            gameState = gameState.copy()
+        if self.incremental != None:
+            self.incremental.start(gameState)
+        return gameState
+
+    def parallelPool(self):
+        """
+          Returns the pool of worker processes used with workers=N (N > 1),
+          creating it the first time.  Each worker holds a copy of this agent
+          and the pool lasts for the life of the agent.
+        """
+        if self.workers <= 1 or multiprocessing.current_process().daemon:
+            return None # Pool workers, e.g. of pacman.py --parallel, cannot have their own
+        if self.pool == None:
+            self.sharedAlpha = multiprocessing.Value('d', -float('inf'))
+            self.pool = multiprocessing.Pool(self.workers, _initSearchWorker, (self, self.sharedAlpha))
+        return self.pool
+
+    def parallelSearch(self, gameState, maxDepth, expandGhost):
+        """
+          Searches the subtrees below the root in parallel and returns the
+          (value, action) of the root.  Each worker task searches the state
+          after one root action or, with expandGhost, after one root action
+          and one reply of the first ghost; those replies are then averaged
+          as the chance node expectimax makes them.
+        """
+        pool = self.parallelPool()
+        actions = gameState.getLegalActions(0)
+        if not expandGhost:
+            actions = orderActions(actions, self.rootHint)
+        tasks, leaves = [], {}
+        for action in actions:
+            if not expandGhost:
+                tasks.append((gameState, [(0, action)], maxDepth, self.deadline))
+                continue
+            child = gameState.generateSuccessor(0, action)
+            self.nodeCount += 1
+            if child.isWin() or child.isLose():
+                leaves[action] = self.evaluationFunction(child)
+                continue
+            for ghostAction in child.getLegalActions(1):
+                tasks.append((gameState, [(0, action), (1, ghostAction)], maxDepth, self.deadline))
+
+        self.sharedAlpha.value = -float('inf')
+        results = pool.map(_searchSubtree, tasks, 1)
+        if None in results:
+            raise SearchTimeout()
+        values = util.Counter()
+        counts = util.Counter()
+        for task, (value, nodes) in zip(tasks, results):
+            self.nodeCount += nodes
+            values[task[1][0][1]] += value
+            counts[task[1][0][1]] += 1
+        v, decision = -float('inf'), None
+        for action in actions:
+            if action in leaves:
+                actionValue = leaves[action]
+            else:
+                actionValue = values[action] / counts[action]
+            if actionValue > v:
+                v, decision = actionValue, action
+        return (v, decision)
+
+    def cutoff(self):
+        "Called at every cutoff of a search, so that SearchStats can count them"
+        pass
+
+    def successor(self, state, agentIndex, action):
+        """
+          Returns the state after agentIndex takes action.  Every call must be
+          followed by restore(successor) once the successor has been searched.
+        """
+        self.nodeCount += 1
+        if self.searchInPlace:
+            state.push(agentIndex, action)
+            successor = state
+        else:
+            successor = state.generateSuccessor(agentIndex, action)
+        if self.incremental != None:
+            self.incremental.push(successor)
+        return successor
+
+    def restore(self, successor):
+        if self.searchInPlace:
+            successor.pop()
+        if self.incremental != None:
+            self.incremental.pop()
+
+    def leafValues(self, state, agentIndex, actions):
+        """
+          Returns the values of the successors of state after each of actions,
+          which must all be leaves of the search, from one call of
+          evaluateBatch.  Returns None if there is no evaluateBatch or the
+          search is in place, where the successors can't all be kept.
+        """
+        if self.evaluateBatch == None or self.searchInPlace:
+            return None
+        successors = []
+        for action in actions:
+            successor = self.successor(state, agentIndex, action)
+            successors.append(successor)
+            self.restore(successor)
+        self.depthCutoff = True
+        return self.evaluateBatch(successors).tolist()
 
 class MinimaxAgent(MultiAgentSearchAgent):
     """
@@ -145,6 +509,15 @@ class MinimaxAgent(MultiAgentSearchAgent):
         Returns the total number of agents in the game
         """
         "*** YOUR CODE HERE ***"
+        return self.chooseAction(gameState)
+
+    def searchDepth(self, gameState, maxDepth, agentIndex=0, depth=-1):
+        """
+          Returns the (value, action) of a minimax search maxDepth plies deep.
+          Subtrees are searched by giving the agent to move and the depth.
+        """
+        gameState = self.searchRoot(gameState)
+        table = self.transpositionTable(gameState)
 
         def value(state, agentIndex, depth):
 
@@ -153,9 +526,14 @@ class MinimaxAgent(MultiAgentSearchAgent):
                 actions = currenState.getLegalActions(agentIndex)
                 if len(actions) == 0:
                     return (self.evaluationFunction(currenState), None)
-                for action in actions:
-                    nextState = currenState.generateSuccessor(agentIndex, action)
-                    nextValue, nextAction = value(nextState, nextAgent, depth)
+                leaves = nextAgent == 0 and depth + 1 == maxDepth and self.leafValues(currenState, agentIndex, actions)
+                for i, action in enumerate(actions):
+                    if leaves:
+                        nextValue = leaves[i]
+                    else:
+                        nextState = self.successor(currenState, agentIndex, action)
+                        nextValue, nextAction = value(nextState, nextAgent, depth)
+                        self.restore(nextState)
                     if nextValue > v:
                         v, decision = nextValue, action
                 return (v, decision)
@@ -165,9 +543,14 @@ class MinimaxAgent(MultiAgentSearchAgent):
                 actions = currenState.getLegalActions(agentIndex)
                 if len(actions) == 0:
                     return (self.evaluationFunction(currenState), None)
-                for action in actions:
-                    nextState = currenState.generateSuccessor(agentIndex, action)
-                    nextValue, nextAction = value(nextState, nextAgent, depth)
+                leaves = nextAgent == 0 and depth + 1 == maxDepth and self.leafValues(currenState, agentIndex, actions)
+                for i, action in enumerate(actions):
+                    if leaves:
+                        nextValue = leaves[i]
+                    else:
+                        nextState = self.successor(currenState, agentIndex, action)
+                        nextValue, nextAction = value(nextState, nextAgent, depth)
+                        self.restore(nextState)
                     if nextValue < v:
                         v, decision = nextValue, action
                 return (v, decision)
@@ -176,55 +559,185 @@ class MinimaxAgent(MultiAgentSearchAgent):
             nextAgent = (numAgents + agentIndex + 1) % numAgents
             if agentIndex == 0:
                 depth+=1
-            if depth == self.depth or gameState.isWin() or gameState.isLose():
+            if self.deadline != None and time.time() > self.deadline:
+                raise SearchTimeout()
+            if depth == maxDepth or gameState.isWin() or gameState.isLose():
+                if depth == maxDepth:
+                    self.depthCutoff = True
                 return (self.evaluationFunction(state), None)
+            if table != None:
+                key = (state.zobrist(), agentIndex, maxDepth - depth)
+                entry = table.lookup(*key)
+                if entry != None:
+                    self.depthCutoff = True # The stored search may have been cut off
+                    return (entry[0], entry[2])
             if agentIndex == 0:
-                return max_value(state)
-            return min_value(state)
+                result = max_value(state)
+            else:
+                result = min_value(state)
+            if table != None:
+                table.store(*(key + (result[0], util.TranspositionTable.EXACT, result[1])))
+            return result
 
-        min_v, action =  value(gameState, 0, -1)
-        return action
+        return value(gameState, agentIndex, depth)
+
+
+class GradingOrdering:
+    """
+      The move ordering the autograder expects: actions in the order
+      getLegalActions gives them, except that the hint (the previous search's
+      best action, from rootHint or the transposition table) goes first.
+
+      A move ordering is told when each search starts, when a node at a ply
+      is entered, when an action becomes the best at a ply and when one
+      causes a cutoff, and orders the actions of each node.
+    """
+
+    def startSearch(self):
+        pass
 
+    def enter(self, ply):
+        pass
+
+    def order(self, state, actions, agentIndex, ply, hint):
+        return orderActions(actions, hint)
+
+    def best(self, ply, action):
+        pass
+
+    def cutoff(self, state, action, agentIndex, ply, depthLeft):
+        pass
+
+class KillerHistoryOrdering(GradingOrdering):
+    """
+      Orders actions by, first to last: the hint, the move of the previous
+      search's principal variation at the ply, the two killer moves of the
+      ply (the latest actions that caused a cutoff there) and the history
+      heuristic, the sum of depthLeft squared over the cutoffs the action
+      has caused from the same position.  Killers and the principal
+      variation last for one search, the history for the whole game.
+    """
+
+    def __init__(self):
+        self.history = util.Counter()
+        self.killers = {}
+        self.pvTable = {}
+        self.pv = []
+
+    def startSearch(self):
+        self.pv = self.pvTable.get(0, [])
+        self.pvTable = {}
+        self.killers = {}
+
+    def enter(self, ply):
+        self.pvTable[ply] = []
+
+    def order(self, state, actions, agentIndex, ply, hint):
+        first = [hint]
+        if ply < len(self.pv):
+            first.append(self.pv[ply])
+        first += self.killers.get(ply, [])
+        position = self.position(state, agentIndex)
+        history = self.history
+        def key(action):
+            if action in first:
+                return (first.index(action), 0)
+            return (len(first), -history[(agentIndex, position, action)])
+        return sorted(actions, key=key)
+
+    def best(self, ply, action):
+        self.pvTable[ply] = [action] + self.pvTable.get(ply + 1, [])
+
+    def cutoff(self, state, action, agentIndex, ply, depthLeft):
+        killers = self.killers.setdefault(ply, [])
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[2:]
+        self.history[(agentIndex, self.position(state, agentIndex), action)] += depthLeft * depthLeft
+
+    def position(self, state, agentIndex):
+        if hasattr(state, 'data'):
+            return state.data.agentStates[agentIndex].configuration.pos
+        return None
+
+# Abbreviations
+grading = GradingOrdering
+killers = KillerHistoryOrdering
 
 class AlphaBetaAgent(MultiAgentSearchAgent):
     """
       Your minimax agent with alpha-beta pruning (question 3)
+
+      ordering names the move ordering: grading (the default) keeps the
+      expansion order the autograder expects and killers orders by killer
+      moves and the history heuristic (see KillerHistoryOrdering).
     """
 
+    def __init__(self, ordering = 'grading', **args):
+        MultiAgentSearchAgent.__init__(self, **args)
+        self.ordering = util.lookup(ordering, globals())()
+
+    def registerInitialState(self, gameState):
+        MultiAgentSearchAgent.registerInitialState(self, gameState)
+        self.ordering = self.ordering.__class__()
+
     def getAction(self, gameState):
         """
           Returns the minimax action using self.depth and self.evaluationFunction
         """
         "*** YOUR CODE HERE ***"
+        return self.chooseAction(gameState)
+
+    def searchDepth(self, gameState, maxDepth, agentIndex=0, depth=-1, alpha=-float('inf'), beta=float('inf')):
+        """
+          Returns the (value, action) of an alpha-beta search maxDepth plies deep.
+          Subtrees are searched by giving the agent to move, depth and window.
+          With workers=N the root actions are searched in parallel.
+        """
+        if agentIndex == 0 and depth == -1 and hasattr(gameState, 'zobrist') and self.parallelPool() != None:
+            return self.parallelSearch(gameState, maxDepth, False)
+        gameState = self.searchRoot(gameState)
+        table = self.transpositionTable(gameState)
+        ordering = self.ordering
+        if depth == -1:
+            ordering.startSearch()
 
         def value(state, agentIndex, depth, alpha, beta):
 
             def max_value(currenState, alpha, beta):
                 v, decision = -float('inf'), None
-                actions = currenState.getLegalActions(agentIndex)
+                actions = ordering.order(currenState, currenState.getLegalActions(agentIndex), agentIndex, ply, tableAction)
                 if len(actions) == 0:
                     return (self.evaluationFunction(currenState), None)
                 for action in actions:
-                    nextState = currenState.generateSuccessor(agentIndex, action)
+                    nextState = self.successor(currenState, agentIndex, action)
                     nextValue, nextAction = value(nextState, nextAgent, depth, alpha, beta)
+                    self.restore(nextState)
                     if nextValue > v:
                         v, decision = nextValue, action
+                        ordering.best(ply, action)
                     if v > beta:
+                        ordering.cutoff(currenState, action, agentIndex, ply, maxDepth - depth)
+                        self.cutoff()
                         return (v, decision)
                     alpha = max(alpha, v)
                 return (v, decision)
 
             def min_value(currenState, alpha, beta):
                 v, decision = float('inf'), None
-                actions = currenState.getLegalActions(agentIndex)
+                actions = ordering.order(currenState, currenState.getLegalActions(agentIndex), agentIndex, ply, tableAction)
                 if len(actions) == 0:
                     return (self.evaluationFunction(currenState), None)
                 for action in actions:
-                    nextState = currenState.generateSuccessor(agentIndex, action)
+                    nextState = self.successor(currenState, agentIndex, action)
                     nextValue, nextAction = value(nextState, nextAgent, depth, alpha, beta)
+                    self.restore(nextState)
                     if nextValue < v:
                         v, decision = nextValue, action
+                        ordering.best(ply, action)
                     if v < alpha:
+                        ordering.cutoff(currenState, action, agentIndex, ply, maxDepth - depth)
+                        self.cutoff()
                         return (v, decision)
                     beta = min(beta, v)
                 return (v, decision)
@@ -233,20 +746,72 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
             nextAgent = (numAgents + agentIndex + 1) % numAgents
             if agentIndex == 0:
                 depth+=1
-            if depth == self.depth or gameState.isWin() or gameState.isLose():
+            ply = depth * numAgents + agentIndex
+            ordering.enter(ply)
+            if self.deadline != None and time.time() > self.deadline:
+                raise SearchTimeout()
+            if depth == maxDepth or gameState.isWin() or gameState.isLose():
+                if depth == maxDepth:
+                    self.depthCutoff = True
                 return (self.evaluationFunction(state), None)
+            tableAction = None
+            if agentIndex == 0 and depth == 0:
+                tableAction = self.rootHint
+            if table != None:
+                key = (state.zobrist(), agentIndex, maxDepth - depth)
+                entry = table.lookup(*key)
+                if entry != None:
+                    self.depthCutoff = True # The stored search may have been cut off
+                    tableValue, flag, tableAction = entry
+                    if flag == util.TranspositionTable.EXACT:
+                        return (tableValue, tableAction)
+                    if flag == util.TranspositionTable.LOWER:
+                        alpha = max(alpha, tableValue)
+                    else:
+                        beta = min(beta, tableValue)
+                    if alpha >= beta:
+                        return (tableValue, tableAction)
             if agentIndex == 0:
-                return max_value(state, alpha, beta)
-            return min_value(state, alpha, beta)
+                result = max_value(state, alpha, beta)
+            else:
+                result = min_value(state, alpha, beta)
+            if table != None:
+                if result[0] <= alpha:
+                    flag = util.TranspositionTable.UPPER
+                elif result[0] >= beta:
+                    flag = util.TranspositionTable.LOWER
+                else:
+                    flag = util.TranspositionTable.EXACT
+                table.store(*(key + (result[0], flag, result[1])))
+            return result
 
-        min_v, action =  value(gameState, 0, -1, -float('inf'), float('inf'))
-        return action
+        return value(gameState, agentIndex, depth, alpha, beta)
 
 class ExpectimaxAgent(MultiAgentSearchAgent):
     """
       Your expectimax agent (question 4)
+
+      With evalBounds=low:high, declaring that the evaluation function is
+      always between low and high, or evalBounds=score, deriving the bounds
+      from the score rules for scoreEvaluationFunction, chance nodes are
+      pruned with Star1, and with star2=True also Star2.  The action and
+      value are those of the plain search as long as the bounds hold.
     """
 
+    def __init__(self, evalBounds = '', star2 = 'False', **args):
+        MultiAgentSearchAgent.__init__(self, **args)
+        self.evalBounds = evalBounds
+        self.star2 = str(star2).lower() in ['true', '1']
+        if evalBounds == 'score':
+            evaluate = getattr(self.evaluationFunction, 'evaluationFunction', self.evaluationFunction)
+            if evaluate != scoreEvaluationFunction:
+                raise Exception('evalBounds=score needs evalFn=scoreEvaluationFunction')
+        elif evalBounds:
+            low, high = [float(bound) for bound in evalBounds.split(':')]
+            if not low < high:
+                raise Exception('evalBounds must be low:high with low < high')
+            self.bounds = (low, high)
+
     def getAction(self, gameState):
         """
           Returns the expectimax action using self.depth and self.evaluationFunction
@@ -255,6 +820,20 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
           legal moves.
         """
         "*** YOUR CODE HERE ***"
+        return self.chooseAction(gameState)
+
+    def searchDepth(self, gameState, maxDepth, agentIndex=0, depth=-1):
+        """
+          Returns the (value, action) of an expectimax search maxDepth plies deep.
+          Subtrees are searched by giving the agent to move and the depth.
+          With workers=N the root actions and first ghost's replies are
+          searched in parallel.
+        """
+        if agentIndex == 0 and depth == -1 and hasattr(gameState, 'zobrist') and self.parallelPool() != None:
+            return self.parallelSearch(gameState, maxDepth, gameState.getNumAgents() > 1)
+        if self.evalBounds:
+            return self.searchPruned(gameState, maxDepth, agentIndex, depth)
+        gameState = self.searchRoot(gameState)
         def value(state, agentIndex, depth):
 
             def max_value(currenState):
@@ -262,9 +841,14 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
                 actions = currenState.getLegalActions(agentIndex)
                 if len(actions) == 0:
                     return (self.evaluationFunction(currenState), None)
-                for action in actions:
-                    nextState = currenState.generateSuccessor(agentIndex, action)
-                    nextValue, nextAction = value(nextState, nextAgent, depth)
+                leaves = nextAgent == 0 and depth + 1 == maxDepth and self.leafValues(currenState, agentIndex, actions)
+                for i, action in enumerate(actions):
+                    if leaves:
+                        nextValue = leaves[i]
+                    else:
+                        nextState = self.successor(currenState, agentIndex, action)
+                        nextValue, nextAction = value(nextState, nextAgent, depth)
+                        self.restore(nextState)
                     if nextValue > v:
                         v, decision = nextValue, action
                 return (v, decision)
@@ -274,9 +858,14 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
                 actions = currenState.getLegalActions(agentIndex)
                 if len(actions) == 0:
                     return (self.evaluationFunction(currenState), None)
-                for action in actions:
-                    nextState = currenState.generateSuccessor(agentIndex, action)
-                    nextValue, nextAction = value(nextState, nextAgent, depth)
+                leaves = nextAgent == 0 and depth + 1 == maxDepth and self.leafValues(currenState, agentIndex, actions)
+                for i, action in enumerate(actions):
+                    if leaves:
+                        nextValue = leaves[i]
+                    else:
+                        nextState = self.successor(currenState, agentIndex, action)
+                        nextValue, nextAction = value(nextState, nextAgent, depth)
+                        self.restore(nextState)
                     v += nextValue
                     decision = action
                 return (v / len(actions), decision)
@@ -285,14 +874,497 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
             nextAgent = (numAgents + agentIndex + 1) % numAgents
             if agentIndex == 0:
                 depth+=1
-            if depth == self.depth or gameState.isWin() or gameState.isLose():
+            if self.deadline != None and time.time() > self.deadline:
+                raise SearchTimeout()
+            if depth == maxDepth or gameState.isWin() or gameState.isLose():
+                if depth == maxDepth:
+                    self.depthCutoff = True
                 return (self.evaluationFunction(state), None)
             if agentIndex == 0:
                 return max_value(state)
             return exp_value(state)
 
-        min_v, action =  value(gameState, 0, -1)
-        return action
+        return value(gameState, agentIndex, depth)
+
+    def scoreBounds(self, gameState, movesLeft):
+        """
+          Returns bounds on the score after the ghosts still to move this
+          round and movesLeft more rounds, from the score rules: each Pacman
+          move loses TIME_PENALTY and may gain 10 for food, winning gains 500,
+          a ghost can be eaten for 200 at most once a round while it is
+          scared or capsules are left, and Pacman dies at most once, for 500
+          per ghost that reaches him.  Ghosts too far away to reach Pacman
+          can neither be eaten nor kill him.
+        """
+        score = gameState.getScore()
+        numFood = gameState.getNumFood()
+        pacman = gameState.getPacmanPosition()
+        capsules = len(gameState.getCapsules()) > 0
+        low = score - movesLeft * TIME_PENALTY
+        high = score + 10 * min(movesLeft, numFood)
+        if numFood <= movesLeft:
+            high += 500
+        for ghost in gameState.getGhostStates():
+            if manhattanDistance(ghost.getPosition(), pacman) <= 2 * movesLeft + 1 + COLLISION_TOLERANCE:
+                low -= 500
+                if capsules or ghost.scaredTimer > 0:
+                    high += 200 * (movesLeft + 1)
+        return (low, high)
+
+    def searchPruned(self, gameState, maxDepth, agentIndex=0, depth=-1):
+        """
+          Returns the (value, action) of searchDepth with the chance nodes
+          pruned by Star1 and, with star2 when Pacman moves next, Star2.
+
+          Each node is searched with a window (alpha, beta).  A chance node
+          knows after each child that its value lies between the mean of the
+          children searched so far with the others at the low bound and the
+          same with the others at the high bound, and returns as soon as that
+          range is outside the window (Star1).  With star2, the last ghost's
+          node first searches only the first action of each Pacman child, a
+          lower bound on the child, which may already put the node above beta
+          and otherwise narrows the range (Star2).  A probe's exact value, and
+          the first action's value when it fell inside the probe's window,
+          are kept for the full search; when the probe fails low or high the
+          first action is searched again.  Star2 pays off only with a tight
+          low bound; the score bounds, which allow for dying, seldom give one.
+          Values returned outside the window are bounds, not exact, as in
+          alpha-beta.
+        """
+        gameState = self.searchRoot(gameState)
+        numAgents = gameState.getNumAgents()
+
+        def value(state, agentIndex, depth, alpha, beta, first=None):
+            if agentIndex == 0:
+                depth += 1
+            if self.deadline != None and time.time() > self.deadline:
+                raise SearchTimeout()
+            if depth == maxDepth or state.isWin() or state.isLose():
+                if depth == maxDepth:
+                    self.depthCutoff = True
+                return (self.evaluationFunction(state), None)
+            actions = state.getLegalActions(agentIndex)
+            if len(actions) == 0:
+                return (self.evaluationFunction(state), None)
+            if agentIndex == 0:
+                return max_value(state, actions, depth, alpha, beta, first)
+            return chance_value(state, actions, agentIndex, depth, alpha, beta)
+
+        def max_value(state, actions, depth, alpha, beta, first):
+            v, decision = -float('inf'), None
+            if first != None:
+                # The first action's value is known from a probe
+                v, decision = first, actions[0]
+                actions = actions[1:]
+            for action in actions:
+                if v >= beta:
+                    break
+                nextState = self.successor(state, 0, action)
+                nextValue = value(nextState, 1 % numAgents, depth, max(alpha, v), beta)[0]
+                self.restore(nextState)
+                if nextValue > v:
+                    v, decision = nextValue, action
+            return (v, decision)
+
+        def probe(state, depth, low, beta):
+            """
+              Returns (bound, exact, first) for the Pacman node state: a
+              lower bound on its value, its value if that is known and the
+              value of its first action if that is known.
+            """
+            depth += 1
+            if self.deadline != None and time.time() > self.deadline:
+                raise SearchTimeout()
+            if depth == maxDepth or state.isWin() or state.isLose():
+                if depth == maxDepth:
+                    self.depthCutoff = True
+                v = self.evaluationFunction(state)
+                return (v, v, None)
+            actions = state.getLegalActions(0)
+            if len(actions) == 0:
+                v = self.evaluationFunction(state)
+                return (v, v, None)
+            nextState = self.successor(state, 0, actions[0])
+            v = value(nextState, 1 % numAgents, depth, low, beta)[0]
+            self.restore(nextState)
+            if v <= low:
+                return (low, None, None)
+            if v >= beta:
+                return (v, None, None)
+            if len(actions) == 1:
+                return (v, v, None)
+            return (v, None, v)
+
+        def chance_value(state, actions, agentIndex, depth, alpha, beta):
+            n = len(actions)
+            if self.evalBounds == 'score':
+                low, high = self.scoreBounds(state, maxDepth - depth - 1)
+            else:
+                low, high = self.bounds
+            nextAgent = (agentIndex + 1) % numAgents
+            lowers, exact, first = [low] * n, [None] * n, [None] * n
+            if self.star2 and nextAgent == 0 and depth + 1 < maxDepth:
+                # Star2: probe the Pacman children for lower bounds, unless
+                # they are at the depth limit and probing is evaluating
+                for i, action in enumerate(actions):
+                    probeBeta = beta * n - sum(lowers[:i]) - (n - i - 1) * low
+                    nextState = self.successor(state, agentIndex, action)
+                    lowers[i], exact[i], first[i] = probe(nextState, depth, low, probeBeta)
+                    self.restore(nextState)
+                    if lowers[i] >= probeBeta:
+                        self.cutoff()
+                        return ((sum(lowers[:i + 1]) + (n - i - 1) * low) / float(n), None)
+
+            # Star1
+            v, decision = 0, None
+            for i, action in enumerate(actions):
+                restLow = sum(lowers[i + 1:])
+                restHigh = (n - i - 1) * high
+                childAlpha = alpha * n - v - restHigh
+                childBeta = beta * n - v - restLow
+                nextValue = exact[i]
+                if nextValue == None:
+                    nextState = self.successor(state, agentIndex, action)
+                    nextValue = value(nextState, nextAgent, depth, childAlpha, childBeta, first[i])[0]
+                    self.restore(nextState)
+                if nextValue <= childAlpha:
+                    self.cutoff()
+                    return ((v + nextValue + restHigh) / float(n), None)
+                if nextValue >= childBeta:
+                    self.cutoff()
+                    return ((v + nextValue + restLow) / float(n), None)
+                v += nextValue
+                decision = action
+            return (v / n, decision)
+
+        return value(gameState, agentIndex, depth, -float('inf'), float('inf'))
+
+class MCTSNode(object):
+    """
+      A state of an MCTSAgent's tree with Pacman to move.  edges maps each
+      action tried from it to an MCTSEdge.
+    """
+    __slots__ = ('state', 'edges')
+
+    def __init__(self, state):
+        self.state = state
+        self.edges = {}
+
+class MCTSEdge(object):
+    """
+      Pacman's action from an MCTSNode.  afterPacman is the state after the
+      action, distributions the ghost models' distributions in that state,
+      children maps the ghosts' replies to the MCTSNodes they lead to and
+      probabilities maps them to their probabilities under distributions.
+    """
+    __slots__ = ('afterPacman', 'distributions', 'children', 'probabilities', 'visits', 'total')
+
+    def __init__(self, afterPacman, distributions):
+        self.afterPacman = afterPacman
+        self.distributions = distributions
+        self.children = {}
+        self.probabilities = {}
+        self.visits = 0
+        self.total = 0.0
+
+class MCTSAgent(MultiAgentSearchAgent):
+    """
+      A Monte Carlo tree search agent.
+
+      Each iteration walks down the tree choosing Pacman's actions by UCT and
+      sampling the ghosts' replies from ghostModel ('random' for RandomGhost,
+      'directional' for DirectionalGhost), adds the state it reaches and
+      values it with the evaluation function plus the change in score over a
+      rollout of rolloutDepth rounds.  The budget is timeBudget seconds per
+      move if it is set and iterations otherwise.  The subtree of the state
+      the game actually reaches is kept for the next move.
+
+      Of the options of MultiAgentSearchAgent only evalFn, evalCache and
+      timeBudget apply to it, so it takes no others.
+    """
+
+    def __init__(self, iterations = '1000', rolloutDepth = '5', ghostModel = 'random',
+                 exploration = '1.4', evalFn = 'scoreEvaluationFunction', evalCache = '0',
+                 timeBudget = '0'):
+        MultiAgentSearchAgent.__init__(self, evalFn=evalFn, evalCache=evalCache, timeBudget=timeBudget)
+        self.iterations = int(iterations)
+        self.rolloutDepth = int(rolloutDepth)
+        if ghostModel not in ['random', 'directional']:
+            raise Exception('Unknown ghost model ' + ghostModel)
+        self.ghostModel = ghostModel
+        self.exploration = float(exploration)
+        self.tree = None
+        self.lastAction = None
+        self.ghosts = None
+
+    def registerInitialState(self, gameState):
+        # There is no transposition table or pool of workers to set up
+        if self.evalCache != None:
+            self.evalCache.clear()
+        self.moveNumber = 0
+        self.tree = None
+        self.lastAction = None
+        self.ghosts = None
+
+    def getAction(self, gameState):
+        """
+          Returns the most visited action at the root after the search.
+        """
+        if self.ghosts == None:
+            if self.ghostModel == 'directional':
+                ghostType = ghostAgents.DirectionalGhost
+            else:
+                ghostType = ghostAgents.RandomGhost
+            self.ghosts = [ghostType(i) for i in range(1, gameState.getNumAgents())]
+        root = self.reusedTree(gameState) or MCTSNode(gameState)
+        means = [edge.total / edge.visits for edge in root.edges.values()]
+        self.low, self.high = min(means + [float('inf')]), max(means + [-float('inf')])
+        start = time.time()
+        iterations = 0
+        while True:
+            if self.timeBudget > 0:
+                if time.time() - start > self.timeBudget and iterations > 0:
+                    break
+            elif iterations >= self.iterations:
+                break
+            self.iterate(root)
+            iterations += 1
+        self.tree = root
+        self.lastAction = max(root.edges.items(), key=lambda item: item[1].visits)[0]
+        return self.lastAction
+
+    def reusedTree(self, gameState):
+        "Returns the node of the last search's tree that gameState reached, if any"
+        if self.tree == None or self.lastAction not in self.tree.edges:
+            return None
+        for child in self.tree.edges[self.lastAction].children.values():
+            if child.state == gameState:
+                return child
+        return None
+
+    def iterate(self, root):
+        "Runs one selection, expansion, rollout and backup from root"
+        node, path = root, []
+        while True:
+            state = node.state
+            if state.isWin() or state.isLose():
+                value = self.evaluationFunction(state)
+                break
+            edge, action = self.select(node)
+            path.append(edge)
+            if edge.distributions == None:
+                value = self.evaluationFunction(edge.afterPacman)
+                break
+            replies = self.sampleReplies(edge)
+            child = edge.children.get(replies)
+            if child == None:
+                child = self.expand(edge, replies)
+                value = self.evaluationFunction(child.state)
+                if not (child.state.isWin() or child.state.isLose()):
+                    value += self.rollout(child.state)
+                break
+            node = child
+        self.low, self.high = min(self.low, value), max(self.high, value)
+        for edge in path:
+            edge.visits += 1
+            edge.total += value
+
+    def select(self, node):
+        """
+          Returns the (edge, action) to follow from node: an action that has
+          not been tried yet if there is one, else the best by UCT with the
+          mean values scaled to the range of values seen in this search.
+        """
+        state = node.state
+        untried = [a for a in state.getLegalActions(0) if a not in node.edges]
+        if untried:
+            action = random.choice(untried)
+            afterPacman = state.generateSuccessor(0, action)
+            self.nodeCount += 1
+            distributions = None
+            if not (afterPacman.isWin() or afterPacman.isLose()):
+                distributions = [ghost.getDistribution(afterPacman) for ghost in self.ghosts]
+            edge = MCTSEdge(afterPacman, distributions)
+            node.edges[action] = edge
+            return edge, action
+
+        visits = sum(edge.visits for edge in node.edges.values())
+        scale = self.high - self.low or 1.0
+        logVisits = math.log(visits)
+        best, bestEdge, bestAction = -float('inf'), None, None
+        for action, edge in node.edges.items():
+            score = (edge.total / edge.visits - self.low) / scale + self.exploration * math.sqrt(logVisits / edge.visits)
+            if score > best:
+                best, bestEdge, bestAction = score, edge, action
+        return bestEdge, bestAction
+
+    def sampleReplies(self, edge):
+        """
+          Returns the ghosts' replies to follow from edge, drawn from the ghost
+          models' distributions.  For progressive widening new replies are
+          only added while the edge has at most sqrt(visits) children, so the
+          tree grows deep as well as wide even with many ghosts; past that a
+          reply that is not in the tree is replaced by one of those that are,
+          drawn in proportion to their probabilities.
+        """
+        replies = tuple([util.chooseFromDistribution(dist) for dist in edge.distributions])
+        if replies not in edge.children and len(edge.children) * len(edge.children) > edge.visits:
+            known = edge.children.keys()
+            replies = util.sample([edge.probabilities[r] for r in known], known)
+        return replies
+
+    def expand(self, edge, replies):
+        "Adds the node the ghosts' replies lead to from edge, and returns it"
+        child = MCTSNode(self.afterGhosts(edge.afterPacman, replies))
+        probability = 1.0
+        for dist, reply in zip(edge.distributions, replies):
+            probability *= dist[reply]
+        edge.children[replies] = child
+        edge.probabilities[replies] = probability
+        return child
+
+    def afterGhosts(self, state, replies):
+        "Returns the state after each ghost in turn plays its reply"
+        for index, action in enumerate(replies):
+            if state.isWin() or state.isLose():
+                break
+            state = state.generateSuccessor(index + 1, action)
+            self.nodeCount += 1
+        return state
+
+    def rollout(self, state):
+        """
+          Plays rolloutDepth rounds from state, Pacman wandering at random
+          without stopping and the ghosts following the ghost model, and
+          returns the change in score.  The moves follow PacmanRules and
+          GhostRules but are played on a few local variables, so no
+          GameStates are made.
+        """
+        data = state.data
+        layout = data.layout
+        pacmanActions, ghostActions = layout.pacmanActions, layout.ghostActions
+        codes, names, vectors = Directions.CODES, Directions.NAMES, Actions._vectors
+        height = data.food.height
+        food, numFood = data.food.bits, data.numFood
+        capsules = list(data.capsules)
+        px, py = data.agentStates[0].configuration.pos
+        ghosts = [[s.configuration.pos[0], s.configuration.pos[1], s.configuration.code, s.scaredTimer, s.start.pos]
+                  for s in data.agentStates[1:]]
+        directional = self.ghostModel == 'directional'
+        change = 0
+        for i in range(self.rolloutDepth):
+            actions = pacmanActions.get((px, py))
+            if actions == None:
+                break # Unwalled boards are left to the full rules
+            moves = [a for a in actions if a != Directions.STOP] or actions
+            dx, dy = vectors[codes[moves[int(random.random() * len(moves))]]]
+            px, py = px + dx, py + dy
+            change -= TIME_PENALTY
+            won = lost = False
+            cell = 1 << (int(px) * height + int(py))
+            if food & cell:
+                food ^= cell
+                change += 10
+                numFood -= 1
+                if numFood == 0:
+                    change += 500
+                    won = True
+            if (px, py) in capsules:
+                capsules.remove((px, py))
+                for ghost in ghosts:
+                    ghost[3] = SCARED_TIME
+            for ghost in ghosts:
+                if abs(ghost[0] - px) + abs(ghost[1] - py) <= COLLISION_TOLERANCE:
+                    if ghost[3] > 0:
+                        change += 200
+                        ghost[0], ghost[1] = ghost[4]
+                        ghost[2], ghost[3] = Directions.STOP_CODE, 0
+                    elif not won:
+                        change -= 500
+                        lost = True
+            if won or lost:
+                break
+
+            for ghost, model in zip(ghosts, self.ghosts):
+                x, y, code, timer = ghost[:4]
+                if x == int(x) and y == int(y):
+                    legal = ghostActions.get(((x, y), code))
+                    if not legal:
+                        continue
+                else:
+                    legal = (names[code],) # In between grid points ghosts continue straight
+                speed = timer > 0 and 0.5 or 1.0
+                if directional:
+                    distances = [abs(x + vectors[codes[a]][0] * speed - px) + abs(y + vectors[codes[a]][1] * speed - py)
+                                 for a in legal]
+                    if timer > 0:
+                        bestDistance, bestProb = max(distances), model.prob_scaredFlee
+                    else:
+                        bestDistance, bestProb = min(distances), model.prob_attack
+                    best = [a for a, d in zip(legal, distances) if d == bestDistance]
+                    r = random.random()
+                    if r < bestProb:
+                        action = best[int(r / bestProb * len(best))]
+                    else:
+                        action = legal[int((r - bestProb) / (1 - bestProb) * len(legal))]
+                else:
+                    action = legal[int(random.random() * len(legal))]
+                code = codes[action]
+                x, y = x + vectors[code][0] * speed, y + vectors[code][1] * speed
+                if timer == 1:
+                    x, y = int(x + 0.5), int(y + 0.5)
+                timer = max(0, timer - 1)
+                ghost[:4] = [x, y, code, timer]
+                if abs(x - px) + abs(y - py) <= COLLISION_TOLERANCE:
+                    if timer > 0:
+                        change += 200
+                        ghost[0], ghost[1] = ghost[4]
+                        ghost[2], ghost[3] = Directions.STOP_CODE, 0
+                    else:
+                        return change - 500
+        return change
+
+_workerAgent = None
+_sharedAlpha = None
+
+def _initSearchWorker(agent, sharedAlpha):
+    """
+      Sets up a worker process of MultiAgentSearchAgent.parallelPool with its
+      own copy of the agent, which searches serially.
+    """
+    global _workerAgent, _sharedAlpha
+    agent.workers = 0
+    agent.pool = None
+    _workerAgent = agent
+    _sharedAlpha = sharedAlpha
+
+def _searchSubtree(task):
+    """
+      Searches the state reached by playing moves from state and returns
+      (value, nodes searched), or None if the deadline passed.
+
+      The best root value found so far is shared between workers as alpha:
+      a min node whose value falls below it can't be the best root action,
+      so starting its search with that alpha is sound.
+    """
+    state, moves, maxDepth, deadline = task
+    agent = _workerAgent
+    for agentIndex, action in moves:
+        state = state.generateSuccessor(agentIndex, action)
+    nextAgent = (moves[-1][0] + 1) % state.getNumAgents()
+    agent.deadline = deadline
+    agent.nodeCount = 1 # The parent counted the moves before the last one
+    try:
+        if isinstance(agent, AlphaBetaAgent):
+            value = agent.searchDepth(state, maxDepth, nextAgent, 0, _sharedAlpha.value)[0]
+            with _sharedAlpha.get_lock():
+                if value > _sharedAlpha.value:
+                    _sharedAlpha.value = value
+        else:
+            value = agent.searchDepth(state, maxDepth, nextAgent, 0)[0]
+    except SearchTimeout:
+        return None
+    return (value, agent.nodeCount)
 
 def betterEvaluationFunction(currentGameState):
     """
@@ -308,6 +1380,7 @@ def betterEvaluationFunction(currentGameState):
     newScaredTimes = [ghostState.scaredTimer for ghostState in newGhostStates]
     newGhostPos = currentGameState.getGhostPositions()
     currentFood = newFood.asList()
+    mazeDistance = currentGameState.data.layout.mazeDistance
     disToGhost = 0
     for pos in newGhostPos:
         dis = manhattanDistance(newPos, pos)
@@ -315,7 +1388,7 @@ def betterEvaluationFunction(currentGameState):
             disToGhost += 1.0 / dis
     foodToFood = 0
     for food in currentFood:
-        foodToFood += 1.0 / manhattanDistance(newPos, food)
+        foodToFood += 1.0 / mazeDistance(newPos, food)
     scoreDif = currentGameState.getScore()
     result = scoreDif + foodToFood - disToGhost + sum(newScaredTimes)
     return result
@@ -323,3 +1396,186 @@ def betterEvaluationFunction(currentGameState):
 # Abbreviation
 better = betterEvaluationFunction
 
+class IncrementalEvaluation:
+    """
+      betterEvaluationFunction, kept up to date along the search path
+      instead of being recomputed from all the food at every leaf.
+
+      The agent calls start() with the root of each search, and push() and
+      pop() around every successor it searches.  Each entry of the path
+      holds the features of one state, made from its parent's with the
+      deltas of the move (_agentMoved, _foodEaten, _capsuleEaten):
+
+        eaten   the food eaten since the root
+        ghosts  each ghost's 1 / distance to Pacman term (0 from 5 on)
+        scared  the ghosts' scared timers
+
+      The food term at a Pacman cell is the sum of 1 / maze distance to the
+      root's food, worked out once per cell while the root's food stays the
+      same, less the terms of the food eaten since the root.  A state that
+      is not at the end of the path, such as the ones MCTSAgent evaluates,
+      is evaluated in full.  With check=True every value is also computed
+      in full and an exception is raised if the two differ.
+    """
+
+    def __init__(self, check=False):
+        self.check = check
+        self.layout = None
+        self.food = None
+        self.rootFood = []
+        self.potentials = {}
+        self.path = []
+
+    def start(self, state):
+        "Starts a new path at the root of a search"
+        data = state.data
+        if data.layout is not self.layout or data.food != self.food:
+            self.layout = data.layout
+            self.food = data.food.copy()
+            self.rootFood = data.food.asList()
+            self.potentials = {}
+        pos = state.getPacmanPosition()
+        ghosts = tuple([self.ghostTerm(pos, s.getPosition()) for s in data.agentStates[1:]])
+        scared = tuple([s.scaredTimer for s in data.agentStates[1:]])
+        self.path = [(data.zobrist(), (), ghosts, scared)]
+
+    def push(self, state):
+        "Extends the path with the successor state of its last state"
+        key, eaten, ghosts, scared = self.path[-1]
+        data = state.data
+        agentIndex = data._agentMoved
+        if agentIndex == 0:
+            if data._foodEaten != None:
+                eaten = eaten + (data._foodEaten,)
+            pos = data.agentStates[0].getPosition()
+            ghosts = tuple([self.ghostTerm(pos, s.getPosition()) for s in data.agentStates[1:]])
+            # Only a capsule or a ghost being eaten changes the timers on Pacman's move
+            if data._capsuleEaten != None or True in data._eaten:
+                scared = tuple([s.scaredTimer for s in data.agentStates[1:]])
+        else:
+            ghost = data.agentStates[agentIndex]
+            i = agentIndex - 1
+            pos = data.agentStates[0].getPosition()
+            ghosts = ghosts[:i] + (self.ghostTerm(pos, ghost.getPosition()),) + ghosts[i + 1:]
+            scared = scared[:i] + (ghost.scaredTimer,) + scared[i + 1:]
+        self.path.append((data.zobrist(), eaten, ghosts, scared))
+
+    def pop(self):
+        self.path.pop()
+
+    def ghostTerm(self, pos, ghostPos):
+        dis = manhattanDistance(pos, ghostPos)
+        if dis != 0 and dis < 5:
+            return 1.0 / dis
+        return 0
+
+    def foodTerm(self, pos, eaten):
+        """
+          The sum of 1 / maze distance from pos to the root's food less the
+          food eaten.  Pacman is never on food, so the food at pos is left out.
+        """
+        mazeDistance = self.layout.mazeDistance
+        potential = self.potentials.get(pos)
+        if potential == None:
+            potential = 0
+            for food in self.rootFood:
+                if food != pos:
+                    potential += 1.0 / mazeDistance(pos, food)
+            self.potentials[pos] = potential
+        for food in eaten:
+            if food != pos:
+                potential -= 1.0 / mazeDistance(pos, food)
+        return potential
+
+    def __call__(self, state):
+        path = self.path
+        if not path or path[-1][0] != state.data.zobrist():
+            return betterEvaluationFunction(state)
+        key, eaten, ghosts, scared = path[-1]
+        value = state.getScore() + self.foodTerm(state.getPacmanPosition(), eaten) - sum(ghosts) + sum(scared)
+        if self.check:
+            full = betterEvaluationFunction(state)
+            if abs(value - full) > 1e-9 * max(1, abs(full)):
+                raise Exception('Incremental evaluation %r differs from %r in\n%s' % (value, full, state))
+        return value
+
+class BatchEvaluation:
+    """
+      betterEvaluationFunction for many states at once with NumPy, for the
+      leaves below one node of a search.  The Pacman cells, food masks,
+      ghost positions, scared timers and scores of the states are stacked
+      into arrays and the distance features are worked out by broadcasting
+      against a table of inverse maze distances, built once per layout.
+      Calling it returns an array of the values.  With check=True every
+      value is also computed by betterEvaluationFunction and an exception
+      is raised if the two differ.
+    """
+
+    def __init__(self, check=False):
+        if numpy == None:
+            raise Exception('batchEval needs NumPy')
+        self.check = check
+        self.layout = None
+
+    def initializeTables(self, layout):
+        """
+          Numbers the cells as layout.cells does and keeps the inverse maze
+          distances between them (0 between a cell and itself, since Pacman
+          is never on food, and between cells that can't reach each other).
+        """
+        if layout.distances == None: layout.initializeDistances()
+        n = len(layout.cells)
+        distances = numpy.array(layout.distances, numpy.float64).reshape(n, n)
+        distances[distances == UNREACHABLE] = float('inf')
+        distances[distances == 0] = float('inf')
+        self.inverseDistances = 1.0 / distances
+        self.cellIndex = layout.cellIndex
+        self.cellBits = numpy.array([x * layout.height + y for x, y in layout.cells])
+        self.numBytes = (layout.width * layout.height + 7) // 8
+        self.layout = layout
+
+    def foodMask(self, food):
+        "The cells of food as a boolean array, in the order of layout.cells"
+        if not hasattr(food, 'bits'):
+            return numpy.array([food[x][y] for x, y in self.layout.cells], bool)
+        # Bit x * height + y of the bitboard is cell (x, y)
+        raw = numpy.frombuffer(binascii.unhexlify(('%x' % food.bits).zfill(2 * self.numBytes)), numpy.uint8)
+        bits = numpy.unpackbits(raw[::-1]).reshape(-1, 8)[:, ::-1].ravel()
+        return bits[self.cellBits].astype(bool)
+
+    def __call__(self, states):
+        layout = states[0].data.layout
+        if layout is not self.layout:
+            self.initializeTables(layout)
+        masks, rows = [], {}
+        foodRows, pacmanCells, pacmanPositions, ghostPositions, scaredTimes, scores = [], [], [], [], [], []
+        for state in states:
+            data = state.data
+            food = data.food
+            # Siblings mostly share their food, whose mask is made once
+            key = getattr(food, 'bits', None)
+            if key == None or key not in rows:
+                rows[key] = len(masks)
+                masks.append(self.foodMask(food))
+            foodRows.append(rows[key])
+            pos = data.agentStates[0].getPosition()
+            pacmanCells.append(self.cellIndex[pos])
+            pacmanPositions.append(pos)
+            ghostPositions.append([s.getPosition() for s in data.agentStates[1:]])
+            scaredTimes.append([s.scaredTimer for s in data.agentStates[1:]])
+            scores.append(data.score)
+
+        foodTerms = (self.inverseDistances[pacmanCells] * numpy.array(masks)[foodRows]).sum(1)
+        values = numpy.array(scores, numpy.float64) + foodTerms
+        if len(ghostPositions[0]) > 0:
+            distances = abs(numpy.array(ghostPositions) - numpy.array(pacmanPositions)[:, None, :]).sum(2)
+            near = (distances != 0) & (distances < 5)
+            values -= numpy.where(near, 1.0 / numpy.where(near, distances, 1), 0).sum(1)
+            values += numpy.array(scaredTimes).sum(1)
+        if self.check:
+            for state, value in zip(states, values):
+                full = betterEvaluationFunction(state)
+                if abs(value - full) > 1e-9 * max(1, abs(full)):
+                    raise Exception('Batch evaluation %r differs from %r in\n%s' % (value, full, state))
+        return values
+
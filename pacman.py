@@ -53,7 +53,7 @@ import sys, types, time, random, os
 # YOUR INTERFACE TO THE PACMAN WORLD: A GameState #
 ###################################################
 
-class GameState:
+class GameState(object):
     """
     A GameState specifies the full game state, including the food, capsules,
     agent configurations and score changes.
@@ -67,19 +67,37 @@ class GameState:
 
     Note that in classic Pacman, Pacman is always agent 0.
     """
+    __slots__ = ('data', '_undoStack')
 
     ####################################################
     # Accessor methods: use these to access state data #
     ####################################################
 
-    # static variable keeps track of which states have had getLegalActions called
-    explored = set()
+    # static variable keeps track of which states have had successors generated,
+    # or None when that is switched off (see trackExplored)
+    explored = None
+    exploredMode = 'off'
     def getAndResetExplored():
-        tmp = GameState.explored.copy()
-        GameState.explored = set()
+        tmp = GameState.explored
+        if tmp == None: return set()
+        GameState.explored = EXPLORED_MODES[GameState.exploredMode]()
         return tmp
     getAndResetExplored = staticmethod(getAndResetExplored)
 
+    def trackExplored(mode):
+        """
+        Chooses what GameState.explored records, and returns the previous mode:
+        'off' records nothing, 'count' the Zobrist keys of the explored states
+        and 'full' the states themselves, which is what grading counts.
+        """
+        if mode not in EXPLORED_MODES:
+            raise Exception('Unknown explored mode %s; use one of %s' % (mode, ', '.join(sorted(EXPLORED_MODES))))
+        previous = GameState.exploredMode
+        GameState.exploredMode = mode
+        GameState.explored = EXPLORED_MODES[mode] and EXPLORED_MODES[mode]()
+        return previous
+    trackExplored = staticmethod(trackExplored)
+
     def getLegalActions( self, agentIndex=0 ):
         """
         Returns the legal actions for the agent specified.
@@ -101,29 +119,65 @@ class GameState:
 
         # Copy current state
         state = GameState(self)
+        state._applyMove( agentIndex, action )
+        state.data.updateZobrist( self.data.agentStates, agentIndex )
+        explored = GameState.explored
+        if explored != None:
+            explored.add(self)
+            explored.add(state)
+        return state
 
-        # Let agent's logic deal with its action's effects on the board
-        if agentIndex == 0:  # Pacman is moving
-            state.data._eaten = [False for i in range(state.getNumAgents())]
-            PacmanRules.applyAction( state, action )
-        else:                # A ghost is moving
-            GhostRules.applyAction( state, action, agentIndex )
-
-        # Time passes
+    def push( self, agentIndex, action ):
+        """
+        Applies the action to this state in place, with exactly the effects of
+        generateSuccessor but without copying the state.  Each push must be
+        undone by a matching pop before the state is used for anything else.
+        Search on a copy() of the state you were given, not the state itself.
+        """
+        if self.isWin() or self.isLose(): raise Exception('Can\'t generate a successor of a terminal state.')
+        data = self.data
+        explored = GameState.explored
+        if explored != None: explored.addData(data)
+        undo = (data.agentStates, data.food, data.capsules, data._eaten, data.score, data.numFood, data._zobrist,
+                data.scoreChange, data._foodEaten, data._foodAdded, data._capsuleEaten, data._agentMoved, data._lose, data._win)
+        try:
+            self._undoStack.append(undo)
+        except AttributeError:
+            self._undoStack = [undo]
+
+        # Only the agent states that the move can change are copied
         if agentIndex == 0:
-            state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
+            data.agentStates = data.copyAgentStates( data.agentStates )
+            data.capsules = data.capsules[:]
         else:
-            GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
-
-        # Resolve multi-agent effects
-        GhostRules.checkDeath( state, agentIndex )
+            data.agentStates = data.agentStates[:]
+            data.agentStates[agentIndex] = data.agentStates[agentIndex].copy()
+            data._eaten = data._eaten[:]
+        data.scoreChange = 0
+        data._foodEaten = None
+        data._foodAdded = None
+        data._capsuleEaten = None
+        data._lose = False
+        data._win = False
+
+        self._applyMove( agentIndex, action )
+        data.updateZobrist( undo[0], agentIndex )
+        if explored != None: explored.addData(data)
+
+    def pop( self ):
+        """
+        Undoes the most recent push.
+        """
+        data = self.data
+        (data.agentStates, data.food, data.capsules, data._eaten, data.score, data.numFood, data._zobrist,
+         data.scoreChange, data._foodEaten, data._foodAdded, data._capsuleEaten, data._agentMoved, data._lose, data._win) = self._undoStack.pop()
 
-        # Book keeping
-        state.data._agentMoved = agentIndex
-        state.data.score += state.data.scoreChange
-        GameState.explored.add(self)
-        GameState.explored.add(state)
-        return state
+    def copy( self ):
+        """
+        Returns a copy of the state that can be searched with push and pop.
+        Unlike deepCopy, the layout and food grid are shared, not rebuilt.
+        """
+        return GameState(self)
 
     def getLegalPacmanActions( self ):
         return self.getLegalActions( 0 )
@@ -175,7 +229,7 @@ class GameState:
         return self.data.capsules
 
     def getNumFood( self ):
-        return self.data.food.count()
+        return self.data.numFood
 
     def getFood(self):
         """
@@ -244,6 +298,14 @@ class GameState:
         """
         return hash( self.data )
 
+    def zobrist( self ):
+        """
+        Returns a 64-bit Zobrist hash of the state.  It is maintained
+        incrementally by generateSuccessor, so it is cheap enough to key
+        transposition tables with.
+        """
+        return self.data.zobrist()
+
     def __str__( self ):
 
         return str(self.data)
@@ -254,15 +316,58 @@ class GameState:
         """
         self.data.initialize(layout, numGhostAgents)
 
+    def _applyMove( self, agentIndex, action ):
+        """
+        Applies the rules for agentIndex taking action to this state's data.
+        """
+        # Let agent's logic deal with its action's effects on the board
+        if agentIndex == 0:  # Pacman is moving
+            self.data._eaten = [False for i in range(self.getNumAgents())]
+            PacmanRules.applyAction( self, action )
+        else:                # A ghost is moving
+            GhostRules.applyAction( self, action, agentIndex )
+
+        # Time passes
+        if agentIndex == 0:
+            self.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
+        else:
+            GhostRules.decrementTimer( self.data.agentStates[agentIndex] )
+
+        # Resolve multi-agent effects
+        GhostRules.checkDeath( self, agentIndex )
+
+        # Book keeping
+        self.data._agentMoved = agentIndex
+        self.data.score += self.data.scoreChange
+
+class ExploredStates(set):
+    """
+    Keeps every explored state, so that equal states are counted once.
+    States changed in place by push are kept as snapshots.
+    """
+    def addData(self, data):
+        self.add(data.snapshot())
+
+class ExploredKeys(set):
+    """
+    Counts the distinct explored states by their Zobrist keys without
+    keeping the states, which is much cheaper than ExploredStates.
+    """
+    def add(self, state):
+        set.add(self, state.data.zobrist())
+
+    def addData(self, data):
+        set.add(self, data.zobrist())
+
+EXPLORED_MODES = {'off': None, 'count': ExploredKeys, 'full': ExploredStates}
+
 ############################################################################
 #                     THE HIDDEN SECRETS OF PACMAN                         #
 #                                                                          #
 # You shouldn't need to look through the code in this section of the file. #
 ############################################################################
 
-SCARED_TIME = 40    # Moves ghosts are scared
-COLLISION_TOLERANCE = 0.7 # How close ghosts must be to Pacman to kill
-TIME_PENALTY = 1 # Number of points lost each round
+from game import SCARED_TIME, COLLISION_TOLERANCE, TIME_PENALTY
 
 class ClassicGameRules:
     """
@@ -332,22 +437,34 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+        return list( PacmanRules.getLegalActionTuple( state ) )
     getLegalActions = staticmethod( getLegalActions )
 
+    def getLegalActionTuple( state ):
+        """
+        Returns the possible actions from the layout's table, which must not
+        be changed.
+        """
+        conf = state.data.agentStates[0].configuration
+        possibleActions = state.data.layout.pacmanActions.get( conf.pos )
+        if possibleActions == None:
+            return Actions.getPossibleActions( conf, state.data.layout.walls )
+        return possibleActions
+    getLegalActionTuple = staticmethod( getLegalActionTuple )
+
     def applyAction( state, action ):
         """
         Edits the state to reflect the results of the action.
         """
-        legal = PacmanRules.getLegalActions( state )
+        legal = PacmanRules.getLegalActionTuple( state )
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
         pacmanState = state.data.agentStates[0]
 
         # Update Configuration
-        vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
-        pacmanState.configuration = pacmanState.configuration.generateSuccessor( vector )
+        code = Directions.CODES[action]
+        pacmanState.configuration = pacmanState.configuration.step( code, PacmanRules.PACMAN_SPEED )
 
         # Eat
         next = pacmanState.configuration.getPosition()
@@ -365,9 +482,8 @@ class PacmanRules:
             state.data.food = state.data.food.copy()
             state.data.food[x][y] = False
             state.data._foodEaten = position
-            # TODO: cache numFood?
-            numFood = state.getNumFood()
-            if numFood == 0 and not state.data._lose:
+            state.data.numFood -= 1
+            if state.data.numFood == 0 and not state.data._lose:
                 state.data.scoreChange += 500
                 state.data._win = True
         # Eat capsule
@@ -389,27 +505,39 @@ class GhostRules:
         Ghosts cannot stop, and cannot turn around unless they
         reach a dead end, but can turn 90 degrees at intersections.
         """
+        return list( GhostRules.getLegalActionTuple( state, ghostIndex ) )
+    getLegalActions = staticmethod( getLegalActions )
+
+    def getLegalActionTuple( state, ghostIndex ):
+        """
+        Returns the legal actions from the layout's table, which must not be
+        changed.  Ghosts in between cells, as scared ghosts are half the
+        time, are not in the table.
+        """
         conf = state.getGhostState( ghostIndex ).configuration
+        legalActions = state.data.layout.ghostActions.get( (conf.pos, conf.code) )
+        if legalActions != None:
+            return legalActions
         possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
-        reverse = Actions.reverseDirection( conf.direction )
+        reverse = Directions.NAMES[Actions._reverseCodes[conf.code]]
         if Directions.STOP in possibleActions:
             possibleActions.remove( Directions.STOP )
         if reverse in possibleActions and len( possibleActions ) > 1:
             possibleActions.remove( reverse )
         return possibleActions
-    getLegalActions = staticmethod( getLegalActions )
+    getLegalActionTuple = staticmethod( getLegalActionTuple )
 
     def applyAction( state, action, ghostIndex):
 
-        legal = GhostRules.getLegalActions( state, ghostIndex )
+        legal = GhostRules.getLegalActionTuple( state, ghostIndex )
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
         ghostState = state.data.agentStates[ghostIndex]
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0: speed /= 2.0
-        vector = Actions.directionToVector( action, speed )
-        ghostState.configuration = ghostState.configuration.generateSuccessor( vector )
+        code = Directions.CODES[action]
+        ghostState.configuration = ghostState.configuration.step( code, speed )
     applyAction = staticmethod( applyAction )
 
     def decrementTimer( ghostState):
@@ -524,6 +652,12 @@ def readCommand( argv ):
                       help='Turns on exception handling and timeouts during games', default=False)
     parser.add_option('--timeout', dest='timeout', type='int',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('--parallel', dest='parallel', type='int',
+                      help=default('Plays the games in N worker processes without graphics; 0 plays them here'),
+                      metavar='N', default=0)
+    parser.add_option('--explored', dest='explored', type='choice', choices=sorted(EXPLORED_MODES),
+                      help=default('Counts the distinct states each game explores by Zobrist key (count) or by keeping them (full)'),
+                      default='off')
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
@@ -532,6 +666,7 @@ def readCommand( argv ):
 
     # Fix the random seed
     if options.fixRandomSeed: random.seed('cs188')
+    GameState.trackExplored(options.explored)
 
     # Choose a layout
     args['layout'] = layout.getLayout( options.layout )
@@ -571,6 +706,8 @@ def readCommand( argv ):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    args['parallel'] = options.parallel
+    args['explored'] = options.explored != 'off'
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
@@ -626,15 +763,100 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
-def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
+class GameResult:
+    """
+    The outcome of a game played in a worker process by runGames.  It has
+    the attributes of Game that outlive the game; the agents and display
+    stay in the worker.
+    """
+    def __init__( self, game, output ):
+        self.state = game.state
+        self.moveHistory = game.moveHistory
+        self.numMoves = game.numMoves
+        self.totalAgentTimes = game.totalAgentTimes
+        self.agentCrashed = game.agentCrashed
+        self.agentTimeout = game.agentTimeout
+        self.statesExplored = game.statesExplored
+        self.output = output
+
+def playGame( game, explored=False ):
+    """
+    Runs game.  With explored=True it also sets game.statesExplored to the
+    number of distinct states GameState.explored recorded during it and
+    empties the record, so it never outgrows one game; otherwise
+    game.statesExplored is None and the record is left alone.
+    """
+    game.statesExplored = None
+    if not explored:
+        game.run()
+        return
+    GameState.getAndResetExplored()
+    game.run()
+    game.statesExplored = len(GameState.getAndResetExplored())
+
+_gameWorker = None
+
+def _initGameWorker( exploredMode, *gameArgs ):
+    global _gameWorker
+    GameState.trackExplored(exploredMode)
+    _gameWorker = gameArgs
+
+def _playGame( seed ):
+    """
+    Plays one game in a worker process.  The random seed is set first, so a
+    game plays the same whichever worker runs it and whatever ran before.
+    """
+    import textDisplay, cStringIO
+    layout, pacman, ghosts, catchExceptions, timeout, explored = _gameWorker
+    random.seed(seed)
+    rules = ClassicGameRules(timeout)
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    try:
+        game = rules.newGame( layout, pacman, ghosts, textDisplay.NullGraphics(), False, catchExceptions)
+        playGame(game, explored)
+        return GameResult(game, sys.stdout.getvalue())
+    finally:
+        sys.stdout = stdout
+
+def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, parallel=0, explored=False ):
+    """
+    Plays numGames games, the first numTraining of them quietly, and prints
+    a summary of the rest.
+
+    With parallel=N (N > 0) the games after training are played in a pool
+    of N processes without graphics, and GameResults are returned in their
+    place.  Each game gets its own seed drawn from random beforehand, so with
+    --fixRandomSeed the results are the same for every N.
+
+    With explored=True (--explored) the summary also gives the number of
+    distinct states each game explored, recorded as GameState.trackExplored
+    chose.
+    """
     import __main__
     __main__.__dict__['_display'] = display
 
     rules = ClassicGameRules(timeout)
     games = []
 
+    results = None
+    if parallel > 0:
+        import multiprocessing
+        seeds = [random.getrandbits(32) for i in range( numGames - numTraining )]
+
     for i in range( numGames ):
         beQuiet = i < numTraining
+        if not beQuiet and parallel > 0:
+            if results == None:
+                pool = multiprocessing.Pool(parallel, _initGameWorker,
+                                            (GameState.exploredMode, layout, pacman, ghosts, catchExceptions, timeout, explored))
+                try: results = pool.map(_playGame, seeds, 1)
+                finally: pool.terminate()
+            game = results[i - numTraining]
+            sys.stdout.write(game.output)
+            games.append(game)
+            if record: recordGame(layout, game, i)
+            continue
         if beQuiet:
                 # Suppress output and graphics
             import textDisplay
@@ -644,16 +866,10 @@ def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0
             gameDisplay = display
             rules.quiet = False
         game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
-        game.run()
+        playGame(game, explored)
         if not beQuiet: games.append(game)
 
-        if record:
-            import time, cPickle
-            fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            cPickle.dump(components, f)
-            f.close()
+        if record: recordGame(layout, game, i)
 
     if (numGames-numTraining) > 0:
         scores = [game.state.getScore() for game in games]
@@ -663,9 +879,19 @@ def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0
         print 'Scores:       ', ', '.join([str(score) for score in scores])
         print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
         print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+        if explored:
+            print 'Explored:     ', ', '.join([str(game.statesExplored) for game in games])
 
     return games
 
+def recordGame( layout, game, i ):
+    import time, cPickle
+    fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
+    f = file(fname, 'w')
+    components = {'layout': layout, 'actions': game.moveHistory}
+    cPickle.dump(components, f)
+    f.close()
+
 if __name__ == '__main__':
     """
     The main function called when pacman.py is run
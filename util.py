@@ -15,7 +15,7 @@
 
 import sys
 import inspect
-import heapq, random
+import heapq, random, collections
 import cStringIO
 
 
@@ -202,6 +202,91 @@ class PriorityQueueWithFunction(PriorityQueue):
         "Adds an item to the queue with priority from the priority function"
         PriorityQueue.push(self, item, self.priorityFunction(item))
 
+class TranspositionTable:
+    """
+      A bounded table of search results for adversarial search agents.
+
+      Entries are keyed by (state hash, agent to move, remaining depth) and
+      hold (value, flag, best action), where flag says whether value is
+      EXACT, a LOWER bound or an UPPER bound on the true value.  The table
+      has a fixed number of slots; a key can only live in the slot its hash
+      maps to, and the replacement policy decides who keeps a contested slot:
+
+        'always'  the newest entry wins
+        'depth'   the entry searched to the greater remaining depth wins
+    """
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, size=100000, replace='depth'):
+        if replace not in ['always', 'depth']:
+            raise Exception('Unknown replacement policy %s' % replace)
+        self.size = size
+        self.replace = replace
+        self.slots = [None] * size
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, stateHash, agentIndex, depth):
+        "Returns (value, flag, action) for the key, or None if it is not stored"
+        key = (stateHash, agentIndex, depth)
+        entry = self.slots[hash(key) % self.size]
+        if entry != None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def store(self, stateHash, agentIndex, depth, value, flag, action):
+        key = (stateHash, agentIndex, depth)
+        slot = hash(key) % self.size
+        entry = self.slots[slot]
+        if self.replace == 'depth' and entry != None and entry[0] != key and entry[0][2] > depth:
+            return
+        self.slots[slot] = (key, (value, flag, action))
+
+    def clear(self):
+        self.slots = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+
+class EvaluationCache:
+    """
+      Wraps an evaluation function of states with a bounded cache of its
+      values.  Calling the cache evaluates a state, looking it up by its
+      Zobrist hash first (or by the state itself if it has none).  Once size
+      values are held, the least recently used one is dropped.
+    """
+
+    def __init__(self, evaluationFunction, size=100000):
+        if size <= 0:
+            raise Exception('The evaluation cache needs a positive size')
+        self.evaluationFunction = evaluationFunction
+        self.size = size
+        self.values = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, state):
+        key = state
+        if hasattr(state, 'zobrist'):
+            key = state.zobrist()
+        values = self.values
+        try:
+            value = values.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = self.evaluationFunction(state)
+            self.misses += 1
+            if len(values) >= self.size:
+                values.popitem(False)
+        values[key] = value
+        return value
+
+    def clear(self):
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+
 
 def manhattanDistance( xy1, xy2 ):
     "Returns the Manhattan distance between points xy1 and xy2"